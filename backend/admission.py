@@ -0,0 +1,121 @@
+import asyncio
+import json
+import math
+import time
+from config import (ADMISSION_LLM_CONCURRENCY, ADMISSION_LLM_QUEUE, ADMISSION_READ_CONCURRENCY,
+                    ADMISSION_READ_QUEUE, ADMISSION_QUEUE_TIMEOUT_SECONDS)
+
+# POST routes that make LLM calls; everything else is a cheap read
+LLM_ROUTES = {
+    "/chat/start", "/chat/message", "/chat/panel_message", "/chat/end",
+    "/chat/evaluate", "/chat/generate_scenario", "/chat/generate_transcript_summary",
+}
+# Never queued or shed, so probes keep answering under overload
+EXEMPT_ROUTES = {"/", "/health", "/admission_stats"}
+
+class RouteClassLimiter:
+    """
+    Admits up to concurrency requests at once and queues up to queue_size
+    more. Requests beyond that, or that wait longer than queue_timeout, are
+    shed immediately instead of piling up in the threadpool.
+    """
+
+    def __init__(self, concurrency: int, queue_size: int, queue_timeout: float):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.avg_seconds = 1.0
+
+    async def acquire(self):
+        # Counted rather than read off the semaphore: a burst arrives before any
+        # earlier acquire has resumed, while the semaphore still looks free
+        if self.active + self.waiting >= self.concurrency + self.queue_size:
+            self.shed += 1
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            self.timed_out += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self, seconds: float):
+        self.active -= 1
+        self.semaphore.release()
+        self.avg_seconds = 0.9 * self.avg_seconds + 0.1 * seconds
+
+    def retry_after(self):
+        # Time for the current queue to drain at the recent service rate
+        return max(1, min(60, math.ceil(self.avg_seconds * (self.waiting + 1) / self.concurrency)))
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "avg_seconds": round(self.avg_seconds, 3),
+        }
+
+limiters = {
+    "llm": RouteClassLimiter(ADMISSION_LLM_CONCURRENCY, ADMISSION_LLM_QUEUE, ADMISSION_QUEUE_TIMEOUT_SECONDS),
+    "read": RouteClassLimiter(ADMISSION_READ_CONCURRENCY, ADMISSION_READ_QUEUE, ADMISSION_QUEUE_TIMEOUT_SECONDS),
+}
+
+def route_class(scope):
+    path = scope["path"].rstrip("/") or "/"
+    if path in EXEMPT_ROUTES or scope["method"] == "OPTIONS":
+        return None
+    if scope["method"] == "POST" and path in LLM_ROUTES:
+        return "llm"
+    return "read"
+
+def admission_stats():
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+class AdmissionControlMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        name = route_class(scope)
+        if name is None:
+            return await self.app(scope, receive, send)
+        limiter = limiters[name]
+        if not await limiter.acquire():
+            return await self.reject(send, limiter.retry_after())
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - started)
+
+    async def reject(self, send, retry_after: int):
+        body = json.dumps({"detail": "Server is busy. Please try again shortly."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -3,6 +3,7 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from pydantic import BaseModel
 from typing import Optional
+from starlette.concurrency import run_in_threadpool
 from db.crud import get_user_by_username, create_user
 from auth.utils import create_access_token
 from config import JWT_SECRET_KEY, JWT_ALGORITHM
@@ -22,7 +23,7 @@ class LoginResponse(BaseModel):
     username: str
     role: str
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+def get_user_from_token(token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -41,8 +42,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
     return {"id": user.id, "username": user.username, "role": user.role, "age": user.age}
 
+# Sync so the user lookup runs in the threadpool instead of blocking the event loop
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    return get_user_from_token(token)
+
 @router.post("/login", response_model=LoginResponse)
-async def login(request: LoginRequest):
+def login(request: LoginRequest):
     username = request.username.strip()
     role = request.role.lower().strip()
     
@@ -84,9 +89,9 @@ async def whop_login(request: Request):
     username = f"whop_{whop_user_id}"
     role = "user"
 
-    user = get_user_by_username(username)
+    user = await run_in_threadpool(get_user_by_username, username)
     if not user:
-        user = create_user(username, role)
+        user = await run_in_threadpool(create_user, username, role)
 
     access_token = create_access_token(data={"sub": user.username})
 
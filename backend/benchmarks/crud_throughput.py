@@ -0,0 +1,102 @@
+"""
+Compares CRUD throughput of one worker using the sync crud functions (run in
+the threadpool, as sync FastAPI routes do) against db.async_crud on the event
+loop. Uses a throwaway SQLite database unless --database-url is given.
+
+    python -m benchmarks.crud_throughput --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--database-url")
+    return parser.parse_args()
+
+def seed(crud, messages: int):
+    user = crud.create_user(f"bench_{time.time_ns()}", "engineer")
+    session_id = crud.create_session(user.id, "Quarterly planning", ["CTO"])
+    crud.save_messages(session_id, [
+        ("User" if i % 2 == 0 else "CTO", f"message {i} about the roadmap", {"score": 7} if i % 2 == 0 else None)
+        for i in range(messages)
+    ])
+    return user, session_id
+
+def workload(user, session_id):
+    # The read mix behind the polling, history and login endpoints
+    return [
+        ("get_session_messages", (session_id, None, 50)),
+        ("get_user_by_username", (user.username,)),
+        ("get_user_sessions", (user.id,)),
+        ("get_user_stats", (user.id,)),
+    ]
+
+async def run(call, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await call(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return requests / (time.perf_counter() - started)
+
+async def benchmark(args, crud, async_crud, calls):
+    from starlette.concurrency import run_in_threadpool
+
+    async def sync_call(i):
+        name, call_args = calls[i % len(calls)]
+        await run_in_threadpool(getattr(crud, name), *call_args)
+
+    async def async_call(i):
+        name, call_args = calls[i % len(calls)]
+        await getattr(async_crud, name)(*call_args)
+
+    # Warm both connection pools before timing
+    await run(sync_call, len(calls), 1)
+    await run(async_call, len(calls), 1)
+    results = {
+        "sync": await run(sync_call, args.requests, args.concurrency),
+        "async": await run(async_call, args.requests, args.concurrency),
+    }
+    await async_crud.async_engine.dispose()
+    return results
+
+def main():
+    args = parse_args()
+    tmpdir = None
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmpdir = tempfile.TemporaryDirectory()
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmpdir.name}/bench.db"
+    os.environ.pop("READ_DATABASE_URL", None)
+
+    from db import crud, async_crud
+    from db.database import init_db
+    init_db()
+    user, session_id = seed(crud, args.messages)
+    calls = workload(user, session_id)
+
+    results = asyncio.run(benchmark(args, crud, async_crud, calls))
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {os.environ['DATABASE_URL'].split(':')[0]}")
+    for name, rate in results.items():
+        print(f"{name:6} {rate:10.0f} req/s")
+    print(f"async/sync {results['async'] / results['sync']:.2f}x")
+    if tmpdir:
+        tmpdir.cleanup()
+
+if __name__ == "__main__":
+    main()
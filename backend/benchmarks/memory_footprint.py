@@ -0,0 +1,83 @@
+"""
+Compares the per-session memory footprint of chat.memory's ring buffer with
+the previous LangChain ChatMessageHistory storage.
+
+    python -m benchmarks.memory_footprint --sessions 10000 --turns 16
+"""
+import argparse
+import sys
+import tracemalloc
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from chat.memory import MemoryMessage
+from config import MEMORY_MAX_MESSAGES
+
+USER_TEXT = "I think we can ship the MVP by Friday if we cut the reporting module."
+AI_TEXT = "Cutting reporting means the board sees nothing next week. Give me a plan that keeps the KPI view."
+
+try:
+    # Imported up front so module import cost stays out of the traced region
+    from langchain_community.chat_message_histories import ChatMessageHistory
+except ImportError:
+    ChatMessageHistory = None
+
+# Every message gets its own string, as real conversations do, on both sides
+def user_text(session_id: int, turn: int):
+    return f"{USER_TEXT} ({session_id}.{turn})"
+
+def ai_text(session_id: int, turn: int):
+    return f"{AI_TEXT} ({session_id}.{turn})"
+
+def ring_buffer_sessions(sessions: int, turns: int):
+    store = {}
+    for session_id in range(sessions):
+        memory = deque(maxlen=MEMORY_MAX_MESSAGES)
+        for turn in range(turns):
+            memory.append(MemoryMessage("human", user_text(session_id, turn)))
+            memory.append(MemoryMessage("ai", ai_text(session_id, turn), "CTO"))
+        store[session_id] = {"memory": memory, "context": {}}
+    return store
+
+def langchain_sessions(sessions: int, turns: int):
+    store = {}
+    for session_id in range(sessions):
+        memory = ChatMessageHistory()
+        for turn in range(turns):
+            memory.add_user_message(user_text(session_id, turn))
+            memory.add_ai_message(f"[CTO]: {ai_text(session_id, turn)}")
+        store[session_id] = {"memory": memory, "context": {}}
+    return store
+
+def measure(builder, sessions: int, turns: int):
+    tracemalloc.start()
+    store = builder(sessions, turns)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    return current
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--turns", type=int, default=MEMORY_MAX_MESSAGES // 2)
+    args = parser.parse_args()
+    if args.turns * 2 > MEMORY_MAX_MESSAGES:
+        # Past the cap the ring buffer drops messages, which would not be a like-for-like comparison
+        print(f"--turns capped at {MEMORY_MAX_MESSAGES // 2} so both stores hold the same messages")
+        args.turns = MEMORY_MAX_MESSAGES // 2
+
+    results = {"ring_buffer": measure(ring_buffer_sessions, args.sessions, args.turns)}
+    if ChatMessageHistory is not None:
+        results["langchain"] = measure(langchain_sessions, args.sessions, args.turns)
+    else:
+        print("langchain_community not installed, skipping baseline")
+
+    print(f"{args.sessions} sessions x {args.turns} turns")
+    for name, size in results.items():
+        print(f"{name:12} {size / 1024 / 1024:8.1f} MiB  {size / args.sessions:8.0f} B/session")
+
+if __name__ == "__main__":
+    main()
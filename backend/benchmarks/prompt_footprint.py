@@ -0,0 +1,186 @@
+"""
+Replays recorded conversations through every prompt builder in chat.agent and
+reports input tokens per call type and per turn. Exits non-zero when a call
+type's mean or max footprint grows past the baseline by more than --threshold.
+
+    python -m benchmarks.prompt_footprint
+    python -m benchmarks.prompt_footprint --update-baseline
+    python -m benchmarks.prompt_footprint --tokenizer tiktoken   # needs benchmarks/requirements.txt
+
+The default "approx" tokenizer is deterministic and dependency-free so the
+committed baseline can be checked anywhere.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT.parent))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+from chat.agent import (build_messages, build_persona_prompt, build_custom_prompt, build_persona_context,
+                        build_coordinator_prompt, build_panel_prompt, build_evaluation_prompt, build_summary_prompt,
+                        build_feedback_prompt, build_scenario_prompt, build_transcript_summary_prompt,
+                        build_chunk_summary_prompt, build_combine_prompt, chunk_transcript, opener_request)
+from config import TRANSCRIPT_REDUCE_FANIN
+from chat.memory import MemoryMessage
+
+FIXTURES = ROOT / "fixtures" / "conversations.json"
+BASELINE = ROOT / "prompt_footprint_baseline.json"
+# Per-message framing overhead added by chat templates
+MESSAGE_OVERHEAD = 4
+# Fixtures fit in one transcript chunk at the real budget, so the map-reduce prompts
+# are measured with a smaller one and a stand-in partial summary
+CHUNK_BUDGET = 200
+PARTIAL_SUMMARY = ("The user proposed cutting scope to hold the Friday date. The counterpart pushed back on "
+                   "losing the reporting view and asked for a concrete plan with owners.")
+APPROX_TOKEN = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+def approx_tokenizer(text: str):
+    return sum(max(1, math.ceil(len(t) / 4)) if t.isalpha() else 1 for t in APPROX_TOKEN.findall(text))
+
+def load_tokenizer(name: str):
+    if name == "approx":
+        return approx_tokenizer
+    import tiktoken
+    encoding = tiktoken.get_encoding("o200k_base")
+    return lambda text: len(encoding.encode(text))
+
+def count_messages(count, messages: list):
+    return sum(count(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+def persona_system_prompt(conversation: dict, persona_key: str):
+    if conversation.get("user_role") and conversation.get("partner_role"):
+        return build_custom_prompt(conversation["partner_role"], conversation.get("partner_personality"),
+                                   conversation["user_role"], conversation.get("user_personality"),
+                                   conversation["scenario"], 0.5)
+    config = conversation.get("persona_configs", {}).get(persona_key, {})
+    return build_persona_prompt(persona_key, conversation["scenario"], config.get("frustration", 0.5),
+                                config.get("goals", ""), config.get("motivations", ""))
+
+def replay(conversation: dict, count):
+    scenario = conversation["scenario"]
+    personas = conversation["personas"]
+    calls = defaultdict(list)
+    per_turn = []
+
+    first = personas[0]
+    config = conversation.get("persona_configs", {}).get(first, {})
+    opener = opener_request(first, scenario, config.get("frustration", 0.5), config.get("goals", ""),
+                            config.get("motivations", ""), conversation.get("user_role"),
+                            conversation.get("partner_role"), conversation.get("user_personality"),
+                            conversation.get("partner_personality"))
+    calls["opener"].append(count_messages(count, opener["messages"]))
+    calls["scenario"].append(count(build_scenario_prompt(conversation.get("user_role") or "manager", "hard",
+                                                         conversation.get("user_role"), conversation.get("partner_role"))))
+
+    history = []
+    for turn in conversation["turns"]:
+        turn_tokens = {}
+        user_message = turn["user"]
+        history.append(MemoryMessage("human", user_message))
+
+        turn_tokens["feedback"] = count(build_feedback_prompt(user_message, scenario))
+        if len(personas) > 1:
+            turn_tokens["coordinator"] = count(build_coordinator_prompt(personas, scenario, user_message))
+        persona_messages = build_messages(persona_system_prompt(conversation, turn["persona"]), user_message,
+                                          build_persona_context(history[-4:], turn["persona"]))
+        turn_tokens["persona"] = count_messages(count, persona_messages)
+
+        history.append(MemoryMessage("ai", turn["reply"], turn["persona"]))
+        for call_type, tokens in turn_tokens.items():
+            calls[call_type].append(tokens)
+        per_turn.append(sum(turn_tokens.values()))
+        # A panel smaller than the session's personas needs the panel call, which /panel_message
+        # makes instead of the coordinator call, so it is kept out of the per-turn total
+        if len(personas) > 1:
+            calls["panel"].append(count(build_panel_prompt(personas, scenario, user_message, len(personas) - 1)))
+
+    transcript_messages = [
+        {"role": "user" if m.type == "human" else "assistant", "content": m.content} for m in history
+    ]
+    calls["evaluation"].append(count(build_evaluation_prompt(transcript_messages, scenario,
+                                                             conversation.get("user_role"),
+                                                             conversation.get("user_personality"))))
+    calls["summary"].append(count(build_summary_prompt(history[-8:], scenario)))
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in transcript_messages)
+    calls["transcript_summary"].append(count(build_transcript_summary_prompt(transcript)))
+    chunks = chunk_transcript(transcript, CHUNK_BUDGET)
+    calls["transcript_chunk"].extend(count(build_chunk_summary_prompt(chunk)) for chunk in chunks)
+    partials = [PARTIAL_SUMMARY] * min(len(chunks), TRANSCRIPT_REDUCE_FANIN)
+    calls["transcript_combine"].append(count(build_combine_prompt(partials)))
+    return calls, per_turn
+
+def run(tokenizer: str):
+    count = load_tokenizer(tokenizer)
+    conversations = json.loads(FIXTURES.read_text())
+    totals = defaultdict(list)
+    turns = {}
+    for conversation in conversations:
+        calls, per_turn = replay(conversation, count)
+        for call_type, values in calls.items():
+            totals[call_type].extend(values)
+        turns[conversation["name"]] = per_turn
+    call_types = {
+        call_type: {"calls": len(values), "mean": round(sum(values) / len(values), 1), "max": max(values)}
+        for call_type, values in sorted(totals.items())
+    }
+    return {"tokenizer": tokenizer, "call_types": call_types, "per_turn": turns}
+
+def compare(report: dict, baseline: dict, threshold: float):
+    regressions = []
+    for call_type, current in report["call_types"].items():
+        previous = baseline["call_types"].get(call_type)
+        if not previous:
+            continue
+        for metric in ("mean", "max"):
+            limit = previous[metric] * (1 + threshold)
+            if current[metric] > limit:
+                regressions.append(f"{call_type}.{metric}: {previous[metric]} -> {current[metric]} "
+                                   f"(+{(current[metric] / previous[metric] - 1) * 100:.1f}%)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokenizer", choices=["approx", "tiktoken"], default="approx")
+    parser.add_argument("--threshold", type=float, default=0.05, help="allowed relative growth, 0.05 = 5%%")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    report = run(args.tokenizer)
+
+    print(f"tokenizer: {report['tokenizer']}")
+    print(f"{'call type':20} {'calls':>6} {'mean':>8} {'max':>6}")
+    for call_type, stats in report["call_types"].items():
+        print(f"{call_type:20} {stats['calls']:>6} {stats['mean']:>8} {stats['max']:>6}")
+    for name, per_turn in report["per_turn"].items():
+        print(f"{name}: per-turn input tokens {per_turn}")
+
+    if args.update_baseline:
+        BASELINE.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"baseline written to {BASELINE.name}")
+        return 0
+
+    if not BASELINE.exists():
+        print("no baseline found, run with --update-baseline")
+        return 0
+    baseline = json.loads(BASELINE.read_text())
+    if baseline.get("tokenizer") != report["tokenizer"]:
+        print(f"baseline uses the {baseline.get('tokenizer')} tokenizer, skipping comparison")
+        return 0
+    regressions = compare(report, baseline, args.threshold)
+    if regressions:
+        print("prompt footprint regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("no regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,67 @@
 from groq import Groq
-from config import GROQ_API_KEY, GROQ_MODEL
+from config import GROQ_API_KEY, TRANSCRIPT_CHUNK_TOKENS, TRANSCRIPT_SUMMARY_CONCURRENCY, TRANSCRIPT_REDUCE_FANIN
 from personas.registry import get_persona
 from chat.memory import get_conversation_history
+from chat.cache import llm_cache
+from chat.routing import model_router
+from chat.usage import record_usage, submit_in_scope
+from chat.breaker import llm_breaker, LLMUnavailableError
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import json
+import random
+import re
+import time
 
 client = Groq(api_key=GROQ_API_KEY)
 
-def get_groq_response(system_prompt, user_message, history_context=""):
+class InvalidPersonaError(ValueError):
+    pass
+
+def routed_params(call_type: str, **params):
+    route = model_router.route(call_type)
+    params["model"] = route["model"]
+    if route["max_tokens"]:
+        params["max_tokens"] = route["max_tokens"]
+    if route["timeout"]:
+        params["timeout"] = route["timeout"]
+    return params
+
+def send_completion(call_type: str, params: dict):
+    llm_breaker.before_call()
+    started = time.monotonic()
+    try:
+        completion = client.chat.completions.create(**params)
+    except Exception as e:
+        elapsed = time.monotonic() - started
+        llm_breaker.record(elapsed, False)
+        model_router.record(call_type, params["model"], elapsed, False)
+        raise LLMUnavailableError(str(e)) from e
+    elapsed = time.monotonic() - started
+    llm_breaker.record(elapsed, True)
+    model_router.record(call_type, params["model"], elapsed, True)
+    record_usage(call_type, params["model"], getattr(completion, "usage", None))
+    return completion
+
+def create_completion(call_type: str, **params):
+    return send_completion(call_type, routed_params(call_type, **params))
+
+def cache_key(params: dict):
+    return llm_cache.make_key(**{k: v for k, v in params.items() if k != "timeout"})
+
+def cached_completion(call_type: str, **params):
+    # Only for calls whose output depends solely on their inputs
+    params = routed_params(call_type, **params)
+    key = cache_key(params)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+    completion = send_completion(call_type, params)
+    content = completion.choices[0].message.content
+    llm_cache.set(key, content)
+    return content
+
+def build_messages(system_prompt, user_message, history_context=""):
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
@@ -15,20 +70,64 @@ def get_groq_response(system_prompt, user_message, history_context=""):
         messages.append({"role": "user", "content": f"Context:\n{history_context}"})
         
     messages.append({"role": "user", "content": user_message})
+    return messages
+
+def get_groq_response(system_prompt, user_message, history_context=""):
+    messages = build_messages(system_prompt, user_message, history_context)
+    
+    # Failures raise LLMUnavailableError so callers never persist error text as a reply
+    completion = create_completion(
+        "persona",
+        messages=messages,
+        temperature=1,
+        max_tokens=1024,
+        top_p=1,
+        stream=False,
+        stop=None
+    )
+    return completion.choices[0].message.content
+
+def stream_groq_response(system_prompt, user_message, history_context=""):
+    messages = build_messages(system_prompt, user_message, history_context)
     
+    params = routed_params(
+        "persona",
+        messages=messages,
+        temperature=1,
+        max_tokens=1024,
+        top_p=1,
+        stream=True,
+        stop=None
+    )
+    llm_breaker.before_call()
+    started = time.monotonic()
+    usage = None
+    ok = None
     try:
-        completion = client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=messages,
-            temperature=1,
-            max_tokens=1024,
-            top_p=1,
-            stream=False,
-            stop=None
-        )
-        return completion.choices[0].message.content
+        stream = client.chat.completions.create(**params)
+        for chunk in stream:
+            # Groq reports usage on the final chunk
+            x_groq = getattr(chunk, "x_groq", None)
+            if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                usage = x_groq.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+        ok = True
     except Exception as e:
-        return f"[System error: {str(e)}]"
+        ok = False
+        raise LLMUnavailableError(str(e)) from e
+    finally:
+        # ok stays None when the consumer closes the generator mid-stream (GeneratorExit)
+        elapsed = time.monotonic() - started
+        if ok is None:
+            llm_breaker.abandon()
+        else:
+            llm_breaker.record(elapsed, ok)
+            model_router.record("persona", params["model"], elapsed, ok)
+    record_usage("persona", params["model"], usage)
 
 def build_persona_prompt(persona_key: str, scenario: str, frustration: float, goals: str, motivations: str):
     persona = get_persona(persona_key)
@@ -66,10 +165,16 @@ RULES:
 - Never summarize what user just said. You are a real busy professional."""
     return prompt
 
-def generate_persona_response(session_id: int, persona_key: str, scenario: str, frustration: float, 
-                              goals: str, motivations: str, user_message: str,
-                              user_role: str = None, partner_role: str = None,
-                              user_personality: str = None, partner_personality: str = None):
+def build_persona_context(history: list, persona_key: str):
+    return "\n".join([
+        f"{'User' if msg.type == 'human' else ('You' if msg.persona == persona_key else msg.persona)}: {msg.content}"
+        for msg in history
+    ])
+
+def prepare_persona_call(session_id: int, persona_key: str, scenario: str, frustration: float, 
+                         goals: str, motivations: str,
+                         user_role: str = None, partner_role: str = None,
+                         user_personality: str = None, partner_personality: str = None):
     
     if user_role and partner_role:
         system_prompt = build_custom_prompt(partner_role, partner_personality, user_role, user_personality, scenario, frustration)
@@ -77,44 +182,145 @@ def generate_persona_response(session_id: int, persona_key: str, scenario: str,
         system_prompt = build_persona_prompt(persona_key, scenario, frustration, goals, motivations)
         
     if not system_prompt:
-        return "Error: Invalid persona configuration"
+        return None, None
     
-    history = get_conversation_history(session_id)
+    history = get_conversation_history(session_id, last=4)
+    return system_prompt, build_persona_context(history, persona_key)
+
+def generate_persona_response(session_id: int, persona_key: str, scenario: str, frustration: float, 
+                              goals: str, motivations: str, user_message: str,
+                              user_role: str = None, partner_role: str = None,
+                              user_personality: str = None, partner_personality: str = None):
     
-    conversation_context = "\n".join([
-        f"{'User' if msg['type'] == 'human' else 'You'}: {msg['content']}"
-        for msg in history[-4:]
-    ])
+    system_prompt, conversation_context = prepare_persona_call(
+        session_id, persona_key, scenario, frustration, goals, motivations,
+        user_role, partner_role, user_personality, partner_personality
+    )
+    if not system_prompt:
+        raise InvalidPersonaError(persona_key)
     
     return get_groq_response(system_prompt, user_message, conversation_context)
 
-def generate_coordinator_decision(session_id: int, personas: list, scenario: str, user_message: str):
+def stream_persona_response(session_id: int, persona_key: str, scenario: str, frustration: float, 
+                            goals: str, motivations: str, user_message: str,
+                            user_role: str = None, partner_role: str = None,
+                            user_personality: str = None, partner_personality: str = None):
     
-    personas_info = [get_persona(p) for p in personas if get_persona(p)]
-    personas_brief = json.dumps([{'key': p, 'name': personas_info[i]['name']} for i, p in enumerate(personas)])
+    system_prompt, conversation_context = prepare_persona_call(
+        session_id, persona_key, scenario, frustration, goals, motivations,
+        user_role, partner_role, user_personality, partner_personality
+    )
+    if not system_prompt:
+        raise InvalidPersonaError(persona_key)
     
-    prompt = f"""Scenario: {scenario}
-Personas: {personas_brief}
+    yield from stream_groq_response(system_prompt, user_message, conversation_context)
+
+OPENER_MESSAGE = "Let's start this conversation about the situation"
+
+def opener_request(persona_key: str, scenario: str, frustration: float, goals: str, motivations: str,
+                   user_role: str = None, partner_role: str = None,
+                   user_personality: str = None, partner_personality: str = None):
+    if user_role and partner_role:
+        system_prompt = build_custom_prompt(partner_role, partner_personality, user_role, user_personality, scenario, frustration)
+    else:
+        system_prompt = build_persona_prompt(persona_key, scenario, frustration, goals, motivations)
+    if not system_prompt:
+        return None
+    # A new session has no history, so the opener depends only on these parameters
+    return routed_params(
+        "opener",
+        messages=build_messages(system_prompt, OPENER_MESSAGE),
+        temperature=1,
+        max_tokens=1024,
+        top_p=1
+    )
+
+def peek_opening_message(persona_key: str, scenario: str, **kwargs):
+    params = opener_request(persona_key, scenario, **kwargs)
+    if not params:
+        return None
+    return llm_cache.peek(cache_key(params))
+
+def generate_opening_message(persona_key: str, scenario: str, **kwargs):
+    params = opener_request(persona_key, scenario, **kwargs)
+    if not params:
+        raise InvalidPersonaError(persona_key)
+    key = cache_key(params)
+    content = send_completion("opener", params).choices[0].message.content
+    llm_cache.set(key, content)
+    return content
+
+def build_personas_brief(personas: list):
+    return json.dumps([{'key': p, 'name': get_persona(p)['name']} for p in personas if get_persona(p)])
+
+def build_coordinator_prompt(personas: list, scenario: str, user_message: str):
+    return f"""Scenario: {scenario}
+Personas: {build_personas_brief(personas)}
 User said: {user_message}
 
 Which persona should respond next? Pick who is most affected or would naturally jump in.
 Respond ONLY as JSON: {{"persona_key": "XXX", "reason": "brief explanation"}}"""
+
+def generate_coordinator_decision(session_id: int, personas: list, scenario: str, user_message: str):
+    prompt = build_coordinator_prompt(personas, scenario, user_message)
     
     try:
-        completion = client.chat.completions.create(
-            model=GROQ_MODEL,
+        completion = create_completion(
+            "coordinator",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.5,
             max_tokens=256,
             response_format={"type": "json_object"}
         )
         result = json.loads(completion.choices[0].message.content)
-        return result.get("persona_key"), result.get("reason")
+        return match_persona(result.get("persona_key"), personas), result.get("reason")
     except:
         return personas[0], "Default selection"
 
-def generate_evaluation(messages: list, scenario: str, user_role: str = None, user_personality: str = None):
+def find_persona(persona_key, personas: list):
+    # The model sometimes answers with a key that isn't in the session or in the wrong case
+    if isinstance(persona_key, str):
+        for p in personas:
+            if p.lower() == persona_key.strip().lower():
+                return p
+    return None
+
+def match_persona(persona_key, personas: list):
+    return find_persona(persona_key, personas) or personas[0]
+
+def build_panel_prompt(personas: list, scenario: str, user_message: str, panel_size: int):
+    return f"""Scenario: {scenario}
+Personas: {build_personas_brief(personas)}
+User said: {user_message}
+
+Which {panel_size} personas should respond next? Pick who is most affected or would naturally jump in.
+Respond ONLY as JSON: {{"persona_keys": ["XXX", ...]}}"""
+
+def generate_panel_decision(session_id: int, personas: list, scenario: str, user_message: str, panel_size: int):
+    # Everyone speaks when the panel is at least as large as the session's personas
+    if panel_size >= len(personas):
+        return list(personas)
+    
+    prompt = build_panel_prompt(personas, scenario, user_message, panel_size)
     
+    try:
+        completion = create_completion(
+            "panel",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.5,
+            max_tokens=256,
+            response_format={"type": "json_object"}
+        )
+        result = json.loads(completion.choices[0].message.content)
+        selected = [p for p in (find_persona(key, personas) for key in result.get("persona_keys", [])) if p]
+        selected = list(dict.fromkeys(selected))[:panel_size]
+        if selected:
+            return selected
+    except:
+        pass
+    return list(personas[:panel_size])
+
+def build_evaluation_prompt(messages: list, scenario: str, user_role: str = None, user_personality: str = None):
     # Only use last 8 messages to keep token count manageable
     recent = messages[-8:] if len(messages) > 8 else messages
     conversation = "\n".join([
@@ -124,100 +330,199 @@ def generate_evaluation(messages: list, scenario: str, user_role: str = None, us
     
     context_str = f" (User: {user_role}, Personality: {user_personality})" if user_role and user_personality else ""
     
-    prompt = f"""Scenario: {scenario}{context_str}
+    return f"""Scenario: {scenario}{context_str}
 
 {conversation}
 
 Give 3-5 actionable insights to improve their communication. Be direct like a friend. One insight per line, no bullets/numbers/dots."""
+
+# Bump whenever build_evaluation_prompt changes so memoized evaluations are recomputed
+EVALUATION_PROMPT_VERSION = 1
+EVALUATION_UNAVAILABLE = "Insights are unavailable right now. Try again in a few minutes."
+
+def generate_evaluation(messages: list, scenario: str, user_role: str = None, user_personality: str = None):
+    prompt = build_evaluation_prompt(messages, scenario, user_role, user_personality)
     
     try:
-        completion = client.chat.completions.create(
-            model=GROQ_MODEL,
+        return cached_completion(
+            "evaluation",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
             max_tokens=1024
         )
-        return completion.choices[0].message.content
-    except Exception as e:
-        return f"Unable to generate insights: {str(e)}"
+    except Exception:
+        return EVALUATION_UNAVAILABLE
 
-def generate_summary(session_id: int, scenario: str):
-    history = get_conversation_history(session_id)
-    
-    # Only use last 8 messages for summary to stay within token limits
-    recent = history[-8:] if len(history) > 8 else history
+def build_summary_prompt(recent: list, scenario: str):
     conversation = "\n".join([
-        f"{'User' if msg['type'] == 'human' else 'Persona'}: {msg['content']}"
+        f"{'User' if msg.type == 'human' else (msg.persona or 'Persona')}: {msg.content}"
         for msg in recent
     ])
     
-    prompt = f"""Scenario: {scenario}
+    return f"""Scenario: {scenario}
 
 {conversation}
 
 2-3 sentence executive summary: what happened, outcome, user's performance."""
+
+SUMMARY_UNAVAILABLE = "Summary unavailable."
+
+def generate_summary(session_id: int, scenario: str):
+    # Only use last 8 messages for summary to stay within token limits
+    prompt = build_summary_prompt(get_conversation_history(session_id, last=8), scenario)
     
     try:
-        completion = client.chat.completions.create(
-            model=GROQ_MODEL,
+        completion = create_completion(
+            "summary",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
             max_tokens=512
         )
         return completion.choices[0].message.content
-    except Exception as e:
-        return f"Summary unavailable: {str(e)}"
+    except Exception:
+        return SUMMARY_UNAVAILABLE
 
-def generate_instant_feedback(user_message: str, scenario: str):
-    prompt = f"""Scenario: "{scenario}"
+def build_feedback_prompt(user_message: str, scenario: str):
+    return f"""Scenario: "{scenario}"
 User said: "{user_message}"
 
 Rate effectiveness 1-10 (be critical, don't default to 8). Give a 1-sentence coaching tip specific to THIS message. Rewrite the message as a 10/10 version.
 Don't penalize brief professional acknowledgments like "Will do" or "Understood" — brevity is fine, score 8-10.
 
 Respond ONLY as JSON: {{ "score": <int>, "feedback": "<string>", "suggested_response": "<string>" }}"""
+
+def generate_instant_feedback(user_message: str, scenario: str):
+    prompt = build_feedback_prompt(user_message, scenario)
     
     try:
-        completion = client.chat.completions.create(
-            model=GROQ_MODEL,
+        completion = create_completion(
+            "feedback",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
             max_tokens=512,
             response_format={"type": "json_object"}
         )
         return json.loads(completion.choices[0].message.content)
+    except LLMUnavailableError:
+        return rule_based_feedback(user_message)
     except Exception as e:
         return {"score": 0, "feedback": "", "suggested_response": ""}
 
-def generate_scenario(role: str, difficulty: str, user_role: str = None, partner_role: str = None):
+DISMISSIVE_PHRASES = ("idk", "whatever", "dunno", "not my problem", "who cares", "fine.")
+HEDGING_WORDS = ("maybe", "i guess", "sort of", "kind of", "probably", "i think")
+
+def rule_based_feedback(user_message: str):
+    # Used while the LLM is unavailable; marked degraded so it is kept out of progress stats
+    text = user_message.strip().lower()
+    words = text.split()
+    score = 6
+    tip = "Be specific about what you will deliver and by when."
+    if any(phrase in text for phrase in DISMISSIVE_PHRASES):
+        score, tip = 2, "Avoid dismissive replies; acknowledge the concern and commit to a next step."
+    elif len(words) < 3:
+        score, tip = 5, "Add a concrete next step or reason so the other side knows where things stand."
+    elif any(word in text for word in HEDGING_WORDS):
+        score, tip = 5, "Drop the hedging and state your position directly."
+    elif any(char.isdigit() for char in text) and len(words) >= 8:
+        score = 7
+    return {"score": score, "feedback": tip, "suggested_response": "", "degraded": True}
+
+# Recently generated scenarios per prompt (role, difficulty and the two roles), served
+# while the LLM is unavailable; the oldest prompts are dropped past SCENARIO_POOL_KEYS
+SCENARIO_POOL_SIZE = 50
+SCENARIO_POOL_KEYS = 200
+scenario_pool = {}
+
+def build_scenario_prompt(role: str, difficulty: str, user_role: str = None, partner_role: str = None):
     if user_role and partner_role:
-        prompt = f"Generate a realistic {difficulty}-difficulty corporate conflict between {user_role} and {partner_role}. Under 3 sentences. Focus on deliverables, deadlines, or resources."
-    else:
-        prompt = f"Generate a realistic {difficulty}-difficulty negotiation scenario for a {role}. Under 3 sentences. Focus on scope, deadlines, or resources."
+        return f"Generate a realistic {difficulty}-difficulty corporate conflict between {user_role} and {partner_role}. Under 3 sentences. Focus on deliverables, deadlines, or resources."
+    return f"Generate a realistic {difficulty}-difficulty negotiation scenario for a {role}. Under 3 sentences. Focus on scope, deadlines, or resources."
+
+def generate_scenario(role: str, difficulty: str, user_role: str = None, partner_role: str = None):
+    prompt = build_scenario_prompt(role, difficulty, user_role, partner_role)
     
     try:
-        completion = client.chat.completions.create(
-            model=GROQ_MODEL,
+        # Not cached: every click should produce a fresh scenario
+        completion = create_completion(
+            "scenario",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
             max_tokens=256
         )
-        return completion.choices[0].message.content.strip()
+        scenario = completion.choices[0].message.content.strip()
     except Exception as e:
+        pool = scenario_pool.get(prompt)
+        if pool:
+            return random.choice(pool)
         return "A high-pressure negotiation is required due to shifting priorities and limited resources."
+    if prompt not in scenario_pool and len(scenario_pool) >= SCENARIO_POOL_KEYS:
+        scenario_pool.pop(next(iter(scenario_pool)))
+    scenario_pool.setdefault(prompt, deque(maxlen=SCENARIO_POOL_SIZE)).append(scenario)
+    return scenario
+
+def build_transcript_summary_prompt(transcript: str):
+    return f"Summarize this negotiation in 3-4 sentences. Focus on outcome and key arguments.\n{transcript}"
+
+def build_chunk_summary_prompt(chunk: str):
+    # Depends only on the chunk text so a chunk's summary is reused wherever it appears
+    return f"Summarize this part of a negotiation in 2-3 sentences. Keep positions, concessions, numbers and commitments.\n{chunk}"
+
+def build_combine_prompt(summaries: list):
+    parts = "\n".join(f"Part {i + 1}: {summary}" for i, summary in enumerate(summaries))
+    return f"These are consecutive parts of one negotiation. Merge them into one summary of at most 4 sentences, in order.\n{parts}"
+
+# A new turn starts on a line beginning with "speaker: "
+TURN_BOUNDARY = re.compile(r"\n(?=[^\n:]{1,40}: )")
+
+def approx_tokens(text: str):
+    return len(text) // 4 + 1
+
+def chunk_transcript(transcript: str, budget: int = TRANSCRIPT_CHUNK_TOKENS):
+    # Greedy packing from the start keeps earlier chunks unchanged as the transcript grows,
+    # so only the tail misses the cache when a longer transcript is re-submitted
+    chunks, current, size = [], [], 0
+    for turn in TURN_BOUNDARY.split(transcript.strip()):
+        tokens = approx_tokens(turn)
+        if current and size + tokens > budget:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        if tokens > budget:
+            step = budget * 4
+            chunks.extend(turn[i:i + step] for i in range(0, len(turn), step))
+            continue
+        current.append(turn)
+        size += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def summarize_prompt(call_type: str, prompt: str, max_tokens: int):
+    return cached_completion(
+        call_type,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.7,
+        max_tokens=max_tokens
+    ).strip()
+
+def summarize_concurrently(call_type: str, prompts: list, max_tokens: int):
+    if len(prompts) == 1:
+        return [summarize_prompt(call_type, prompts[0], max_tokens)]
+    with ThreadPoolExecutor(max_workers=min(TRANSCRIPT_SUMMARY_CONCURRENCY, len(prompts))) as pool:
+        futures = [submit_in_scope(pool, summarize_prompt, call_type, p, max_tokens) for p in prompts]
+        return [future.result() for future in futures]
 
 def generate_transcript_summary(transcript: str):
-    # Truncate transcript to last ~2000 chars to stay within token limits
-    truncated = transcript[-2000:] if len(transcript) > 2000 else transcript
-    prompt = f"Summarize this negotiation in 3-4 sentences. Focus on outcome and key arguments.\n{truncated}"
-    
     try:
-        completion = client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=512
-        )
-        return completion.choices[0].message.content.strip()
+        chunks = chunk_transcript(transcript)
+        if len(chunks) <= 1:
+            return summarize_prompt("transcript_summary", build_transcript_summary_prompt(transcript), 512)
+        
+        # Map: summarize every chunk; reduce: merge summaries in groups until one level fits a single call
+        summaries = summarize_concurrently("transcript_chunk", [build_chunk_summary_prompt(c) for c in chunks], 256)
+        while len(summaries) > TRANSCRIPT_REDUCE_FANIN:
+            groups = [summaries[i:i + TRANSCRIPT_REDUCE_FANIN] for i in range(0, len(summaries), TRANSCRIPT_REDUCE_FANIN)]
+            summaries = summarize_concurrently("transcript_chunk", [build_combine_prompt(g) for g in groups], 256)
+        
+        return summarize_prompt("transcript_summary", build_transcript_summary_prompt("\n".join(summaries)), 512)
     except Exception as e:
         return "Summary generation unavailable."
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import deque
+from config import (LLM_BREAKER_WINDOW, LLM_BREAKER_MIN_CALLS, LLM_BREAKER_ERROR_RATE,
+                    LLM_BREAKER_SLOW_SECONDS, LLM_BREAKER_OPEN_SECONDS)
+
+class LLMUnavailableError(Exception):
+    pass
+
+class CircuitOpenError(LLMUnavailableError):
+    pass
+
+class CircuitBreaker:
+    """
+    Fails LLM calls fast while the backend is unhealthy.
+    Calls that error or take longer than slow_seconds count as failures. Once
+    the failure rate over the window crosses error_rate the breaker opens for
+    open_seconds, then lets a single probe call through (half-open) to decide
+    whether to close again. A probe that never reports back is replaced after
+    another open_seconds.
+    """
+
+    def __init__(self, window: int, min_calls: int, error_rate: float, slow_seconds: float, open_seconds: float):
+        self.results = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.probe_started_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now - self.opened_at >= self.open_seconds:
+                self.state = "half_open"
+            if self.state == "half_open" and (not self.probe_in_flight or now - self.probe_started_at >= self.open_seconds):
+                self.probe_in_flight = True
+                self.probe_started_at = now
+                return
+            self.rejected += 1
+            raise CircuitOpenError("LLM backend circuit is open")
+
+    def record(self, latency: float, ok: bool):
+        failed = not ok or latency > self.slow_seconds
+        with self.lock:
+            if self.state == "half_open":
+                self.probe_in_flight = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = "closed"
+                    self.results.clear()
+                return
+            self.results.append(failed)
+            if len(self.results) >= self.min_calls and sum(self.results) / len(self.results) >= self.error_rate:
+                self._open()
+
+    def abandon(self):
+        # The caller gave up before the call finished (e.g. a closed stream); this says
+        # nothing about backend health, except that a probe must not stay in flight
+        with self.lock:
+            if self.state == "half_open" and self.probe_in_flight:
+                self.probe_in_flight = False
+                self._open()
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self.results.clear()
+
+    def retry_after(self):
+        with self.lock:
+            if self.state != "open":
+                return 1
+            return max(1, int(self.open_seconds - (time.monotonic() - self.opened_at)) + 1)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "window_failures": sum(self.results),
+                "window_size": len(self.results)
+            }
+
+llm_breaker = CircuitBreaker(LLM_BREAKER_WINDOW, LLM_BREAKER_MIN_CALLS, LLM_BREAKER_ERROR_RATE,
+                             LLM_BREAKER_SLOW_SECONDS, LLM_BREAKER_OPEN_SECONDS)
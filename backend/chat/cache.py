@@ -0,0 +1,105 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import LLM_CACHE_SIZE, LLM_CACHE_PATH, LLM_CACHE_DISK_SIZE
+
+PRUNE_EVERY = 100
+
+class ResultCache:
+    """
+    Content-addressed LRU cache for LLM results.
+    Keys hash the full request (model, messages, parameters). When a path is
+    configured, entries are also written to SQLite so they survive restarts.
+    """
+
+    def __init__(self, max_size: int = 1024, path: str = None, disk_size: int = 20000):
+        self.max_size = max_size
+        self.disk_size = disk_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.writes = 0
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT, created_at REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_created_at ON llm_cache (created_at)")
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(**params) -> str:
+        payload = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            if self.conn is not None:
+                row = self.conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def peek(self, key: str):
+        # Lookup without touching hit/miss stats or recency
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+            if self.conn is not None:
+                row = self.conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    return json.loads(row[0])
+            return None
+
+    def set(self, key: str, value):
+        with self.lock:
+            self._remember(key, value)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time())
+                )
+                self.writes += 1
+                if self.writes % PRUNE_EVERY == 0:
+                    self.conn.execute(
+                        "DELETE FROM llm_cache WHERE key NOT IN "
+                        "(SELECT key FROM llm_cache ORDER BY created_at DESC LIMIT ?)",
+                        (self.disk_size,)
+                    )
+                self.conn.commit()
+
+    def _remember(self, key: str, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "persistent": self.conn is not None
+            }
+
+llm_cache = ResultCache(LLM_CACHE_SIZE, LLM_CACHE_PATH or None, LLM_CACHE_DISK_SIZE)
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+from fastapi import HTTPException
+from config import IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_WAIT_SECONDS
+
+class IdempotencyEntry:
+    __slots__ = ("done", "result", "failed", "created_at")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+        self.created_at = time.monotonic()
+
+class IdempotencyStore:
+    """
+    Bounded TTL store of request results keyed by Idempotency-Key.
+    The first request with a key runs; duplicates arriving while it is in
+    flight wait for it, and later duplicates replay the stored result.
+    """
+
+    def __init__(self, ttl: int = 600, max_keys: int = 10000, wait: int = 120):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.wait = wait
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            expired = now - entry.created_at > self.ttl
+            if not expired and len(self.entries) <= self.max_keys:
+                break
+            # Never evict a request that is still running
+            if not entry.done.is_set() and not expired:
+                break
+            self.entries.popitem(last=False)
+
+    def run(self, key: str, fn):
+        if key is None:
+            return fn()
+
+        with self.lock:
+            now = time.monotonic()
+            self._evict(now)
+            entry = self.entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = IdempotencyEntry()
+                self.entries[key] = entry
+
+        if not owner:
+            if not entry.done.wait(self.wait):
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+            if entry.failed:
+                # The original attempt failed, so this retry gets to run it again
+                return self.run(key, fn)
+            return entry.result
+
+        try:
+            entry.result = fn()
+            return entry.result
+        except BaseException:
+            entry.failed = True
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+            raise
+        finally:
+            entry.done.set()
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_WAIT_SECONDS)
+
+def run_idempotent(user: dict, route: str, key: str, fn):
+    scoped_key = f"{user['id']}:{route}:{key}" if key else None
+    return idempotency_store.run(scoped_key, fn)
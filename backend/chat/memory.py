@@ -1,32 +1,51 @@
-from langchain_community.chat_message_histories import ChatMessageHistory
+from collections import deque
+from itertools import islice
+from config import MEMORY_MAX_MESSAGES
 
 chat_sessions = {}
 
+class MemoryMessage:
+    __slots__ = ("type", "content", "persona")
+
+    def __init__(self, type: str, content: str, persona: str = None):
+        self.type = type
+        self.content = content
+        self.persona = persona
+
 def get_or_create_memory(session_id: int):
     if session_id not in chat_sessions:
         chat_sessions[session_id] = {
-            "memory": ChatMessageHistory(),
+            # Prompts only ever look at the tail, so older turns are dropped
+            "memory": deque(maxlen=MEMORY_MAX_MESSAGES),
             "context": {}
         }
     return chat_sessions[session_id]
 
 def add_user_message(session_id: int, message: str):
     session = get_or_create_memory(session_id)
-    session["memory"].add_user_message(message)
+    session["memory"].append(MemoryMessage("human", message))
+    session["context"].pop("evaluation", None)
 
 def add_ai_message(session_id: int, persona: str, message: str):
     session = get_or_create_memory(session_id)
-    session["memory"].add_ai_message(f"[{persona}]: {message}")
+    session["memory"].append(MemoryMessage("ai", message, persona))
+    session["context"].pop("evaluation", None)
+
+def remove_last_message(session_id: int):
+    session = get_or_create_memory(session_id)
+    if session["memory"]:
+        session["memory"].pop()
+    session["context"].pop("evaluation", None)
 
-def get_conversation_history(session_id: int):
+def get_conversation_history(session_id: int, last: int = None):
     session = get_or_create_memory(session_id)
-    messages = []
-    for msg in session["memory"].messages:
-        messages.append({
-            "type": msg.type,
-            "content": msg.content
-        })
-    return messages
+    memory = session["memory"]
+    if last is None or last >= len(memory):
+        return list(memory)
+    # Walk back from the end so only the requested tail is touched
+    tail = list(islice(reversed(memory), last))
+    tail.reverse()
+    return tail
 
 def update_context(session_id: int, key: str, value):
     session = get_or_create_memory(session_id)
@@ -38,4 +57,4 @@ def get_context(session_id: int):
 
 def clear_session(session_id: int):
     if session_id in chat_sessions:
-        del chat_sessions[session_id]
\ No newline at end of file
+        del chat_sessions[session_id]
@@ -1,15 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from auth.routes import get_current_user
-from db.crud import (create_session, save_message, get_session_messages, 
-                     end_session, save_summary, get_user_sessions, delete_session)
+from auth.routes import get_current_user, get_user_from_token
+from db.crud import (create_session, save_message, save_messages, get_session_messages, end_session, save_summary,
+                     set_message_feedback, get_last_message_id, get_message_feedback, get_user_sessions,
+                     delete_session, get_user_stats, search_history, get_user_usage, get_session_owner)
 from chat.memory import (add_user_message, add_ai_message, get_conversation_history, 
-                         update_context, clear_session, get_context)
-from chat.agent import (generate_persona_response, generate_coordinator_decision, 
+                         update_context, clear_session, get_context, remove_last_message)
+from chat.agent import (generate_persona_response, generate_coordinator_decision, generate_panel_decision,
                         generate_evaluation, generate_summary, generate_instant_feedback,
-                        generate_scenario, generate_transcript_summary)
+                        generate_scenario, generate_transcript_summary, stream_persona_response,
+                        generate_opening_message, peek_opening_message,
+                        EVALUATION_PROMPT_VERSION, EVALUATION_UNAVAILABLE, SUMMARY_UNAVAILABLE,
+                        InvalidPersonaError)
+from chat.cache import llm_cache
+from chat.idempotency import run_idempotent
+from chat.routing import model_router
+from chat.usage import usage_limiter, set_usage_scope, submit_in_scope
+from chat.breaker import llm_breaker, LLMUnavailableError
 from personas.registry import get_all_personas
+from admission import limiters as admission_limiters
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
@@ -26,18 +41,34 @@ class StartSessionRequest(BaseModel):
 
 class StartSessionResponse(BaseModel):
     session_id: int
+    opener: Optional[dict] = None
+    opener_pending: bool = False
 
 class SendMessageRequest(BaseModel):
     session_id: int
     message: str
+    defer_feedback: bool = False
 
 class MessageResponse(BaseModel):
     persona: str
     message: str
     feedback: Optional[dict] = None
+    message_id: Optional[int] = None
+    feedback_pending: bool = False
+
+class PanelMessageRequest(BaseModel):
+    session_id: int
+    message: str
+    panel_size: Optional[int] = Field(None, ge=1)
+
+class PanelMessageResponse(BaseModel):
+    replies: List[MessageResponse]
+    feedback: Optional[dict] = None
 
 class GetMessagesResponse(BaseModel):
     messages: List[dict]
+    last_id: Optional[int] = None
+    pending: bool = False
 
 class EndSessionRequest(BaseModel):
     session_id: int
@@ -71,12 +102,40 @@ class GenerateTranscriptSummaryRequest(BaseModel):
     transcript: str
 
 
+def persona_call_args(context: dict, persona_key: str):
+    persona_config = context.get("persona_configs", {}).get(persona_key, {})
+    return {
+        "frustration": persona_config.get('frustration', 0.5),
+        "goals": persona_config.get('goals', ''),
+        "motivations": persona_config.get('motivations', ''),
+        "user_role": context.get("user_role"),
+        "partner_role": context.get("partner_role"),
+        "user_personality": context.get("user_personality"),
+        "partner_personality": context.get("partner_personality")
+    }
+
+def begin_llm_request(user: dict, session_id: int = None):
+    # Rejects with 429 before any LLM work when the user is over budget
+    usage_limiter.check(user['id'])
+    set_usage_scope(user['id'], session_id)
+
+def llm_unavailable():
+    return HTTPException(
+        status_code=503,
+        detail="The AI is temporarily unavailable. Please try again shortly.",
+        headers={"Retry-After": str(llm_breaker.retry_after())}
+    )
+
 @router.get("/personas", response_model=GetPersonasResponse)
-def get_personas():
+async def get_personas():
     return GetPersonasResponse(personas=get_all_personas())
 
 @router.post("/start", response_model=StartSessionResponse)
-def start_session(request: StartSessionRequest, user=Depends(get_current_user)):
+def start_session(request: StartSessionRequest, background_tasks: BackgroundTasks, user=Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return run_idempotent(user, "start", idempotency_key, lambda: process_start(request, background_tasks, user))
+
+def process_start(request: StartSessionRequest, background_tasks: BackgroundTasks, user: dict):
+    begin_llm_request(user)
     # Determine mode
     is_custom_mode = request.user_role and request.partner_role
     
@@ -108,35 +167,46 @@ def start_session(request: StartSessionRequest, user=Depends(get_current_user)):
         update_context(session_id, "user_personality", request.user_personality)
         update_context(session_id, "partner_personality", request.partner_personality)
     
-    if len(personas) == 1:
-        first_persona = personas[0]
-    else:
-        first_persona, _ = generate_coordinator_decision(
-            session_id, personas, request.scenario, 
-            "Starting the conversation"
-        )
-    
-    persona_config = request.persona_configs.get(first_persona, {})
-    
-    first_message = generate_persona_response(
-        session_id, first_persona, request.scenario,
-        persona_config.get('frustration', 0.5),
-        persona_config.get('goals', ''),
-        persona_config.get('motivations', ''),
-        "Let's start this conversation about the situation",
-        user_role=request.user_role,
-        partner_role=request.partner_role,
-        user_personality=request.user_personality,
-        partner_personality=request.partner_personality
-    )
+    # The opener comes from the first persona, so no coordinator call is needed
+    first_persona = personas[0] if personas else "Counterpart"
+    opener_args = persona_call_args(get_context(session_id), first_persona)
     
-    add_ai_message(session_id, first_persona, first_message)
-    save_message(session_id, first_persona, first_message)
+    # Nothing is pre-generated: scenarios are written fresh per session, so the only openers
+    # ready in advance are repeats of an earlier persona/scenario/config still in the LLM cache
+    cached_opener = peek_opening_message(first_persona, request.scenario, **opener_args)
+    if cached_opener is not None:
+        deliver_opener(session_id, first_persona, cached_opener)
+        return StartSessionResponse(
+            session_id=session_id,
+            opener={"persona": first_persona, "message": cached_opener}
+        )
     
-    return StartSessionResponse(session_id=session_id)
+    # Otherwise return right away; the opener shows up on /chat/messages once generated
+    update_context(session_id, "opener_pending", True)
+    background_tasks.add_task(generate_opener, user['id'], session_id, first_persona, request.scenario, opener_args)
+    return StartSessionResponse(session_id=session_id, opener_pending=True)
+
+def generate_opener(user_id: int, session_id: int, persona_key: str, scenario: str, opener_args: dict):
+    set_usage_scope(user_id, session_id)
+    try:
+        message = generate_opening_message(persona_key, scenario, **opener_args)
+        deliver_opener(session_id, persona_key, message)
+    except (LLMUnavailableError, InvalidPersonaError):
+        # No opener rather than an error message; the user can start the conversation
+        pass
+    finally:
+        update_context(session_id, "opener_pending", False)
+
+def deliver_opener(session_id: int, persona_key: str, message: str):
+    add_ai_message(session_id, persona_key, message)
+    save_message(session_id, persona_key, message)
 
 @router.post("/message", response_model=MessageResponse)
-def send_message(request: SendMessageRequest, user=Depends(get_current_user)):
+def send_message(request: SendMessageRequest, background_tasks: BackgroundTasks, user=Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return run_idempotent(user, "message", idempotency_key, lambda: process_message(request, background_tasks, user))
+
+def process_message(request: SendMessageRequest, background_tasks: BackgroundTasks, user: dict):
+    begin_llm_request(user, request.session_id)
     add_user_message(request.session_id, request.message)
     
     context = get_context(request.session_id)
@@ -166,43 +236,269 @@ def send_message(request: SendMessageRequest, user=Depends(get_current_user)):
     
     persona_config = persona_configs.get(responding_persona, {})
     
-    feedback = generate_instant_feedback(request.message, scenario)
+    # Deferred feedback is scored after the response is sent and fetched from /chat/feedback
+    feedback = None if request.defer_feedback else generate_instant_feedback(request.message, scenario)
     
-    save_message(request.session_id, "User", request.message, feedback)
+    try:
+        response = generate_persona_response(
+            request.session_id, responding_persona, scenario,
+            persona_config.get('frustration', 0.5),
+            persona_config.get('goals', ''),
+            persona_config.get('motivations', ''),
+            request.message,
+            user_role=user_role,
+            partner_role=partner_role,
+            user_personality=user_personality,
+            partner_personality=partner_personality
+        )
+    except LLMUnavailableError:
+        # Nothing from a failed turn is kept, so a retry starts clean
+        remove_last_message(request.session_id)
+        raise llm_unavailable()
+    except InvalidPersonaError:
+        remove_last_message(request.session_id)
+        raise HTTPException(status_code=400, detail="Invalid persona configuration")
     
-    response = generate_persona_response(
-        request.session_id, responding_persona, scenario,
-        persona_config.get('frustration', 0.5),
-        persona_config.get('goals', ''),
-        persona_config.get('motivations', ''),
-        request.message,
-        user_role=user_role,
-        partner_role=partner_role,
-        user_personality=user_personality,
-        partner_personality=partner_personality
+    add_ai_message(request.session_id, responding_persona, response)
+    user_message_id, _ = save_messages(
+        request.session_id,
+        [("User", request.message, feedback), (responding_persona, response, None)]
     )
     
-    add_ai_message(request.session_id, responding_persona, response)
-    save_message(request.session_id, responding_persona, response)
+    if request.defer_feedback:
+        pending_feedback.add(user_message_id)
+        background_tasks.add_task(generate_deferred_feedback, user['id'], request.session_id, user_message_id, request.message, scenario)
     
-    return MessageResponse(persona=responding_persona, message=response, feedback=feedback)
+    return MessageResponse(
+        persona=responding_persona, message=response, feedback=feedback,
+        message_id=user_message_id, feedback_pending=request.defer_feedback
+    )
+
+# Ids of user messages whose deferred feedback is still being generated
+pending_feedback = set()
+
+def generate_deferred_feedback(user_id: int, session_id: int, message_id: int, message: str, scenario: str):
+    set_usage_scope(user_id, session_id)
+    try:
+        set_message_feedback(message_id, generate_instant_feedback(message, scenario))
+    finally:
+        pending_feedback.discard(message_id)
+
+@router.get("/feedback/{message_id}")
+def get_feedback(message_id: int, user=Depends(get_current_user)):
+    result = get_message_feedback(message_id)
+    # Other users' messages are reported as missing rather than forbidden
+    if result is None or result["user_id"] != user['id']:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return {
+        "message_id": message_id,
+        "feedback": result["feedback"],
+        "pending": result["feedback"] is None and message_id in pending_feedback
+    }
+
+@router.post("/panel_message", response_model=PanelMessageResponse)
+def send_panel_message(request: PanelMessageRequest, user=Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return run_idempotent(user, "panel_message", idempotency_key, lambda: process_panel_message(request, user))
+
+def process_panel_message(request: PanelMessageRequest, user: dict):
+    begin_llm_request(user, request.session_id)
+    context = get_context(request.session_id)
+    
+    scenario = context.get("scenario", "")
+    personas = context.get("personas", []) or ["Counterpart"]
+    
+    panel_size = min(request.panel_size or len(personas), len(personas))
+    responding_personas = generate_panel_decision(
+        request.session_id, personas, scenario, request.message, panel_size
+    )
+    
+    def reply(persona_key):
+        return generate_persona_response(
+            request.session_id, persona_key, scenario,
+            user_message=request.message, **persona_call_args(context, persona_key)
+        )
+    
+    # Feedback and every panel reply run concurrently against the same history,
+    # so the turn takes about as long as the slowest single call
+    with ThreadPoolExecutor(max_workers=len(responding_personas) + 1) as pool:
+        feedback_future = submit_in_scope(pool, generate_instant_feedback, request.message, scenario)
+        reply_futures = [submit_in_scope(pool, reply, p) for p in responding_personas]
+        feedback = feedback_future.result()
+        replies = []
+        for persona_key, future in zip(responding_personas, reply_futures):
+            try:
+                replies.append((persona_key, future.result()))
+            except (LLMUnavailableError, InvalidPersonaError):
+                continue
+    
+    if not replies:
+        raise llm_unavailable()
+    
+    add_user_message(request.session_id, request.message)
+    for persona_key, response in replies:
+        add_ai_message(request.session_id, persona_key, response)
+    
+    save_messages(
+        request.session_id,
+        [("User", request.message, feedback)] + [(p, r, None) for p, r in replies]
+    )
+    
+    return PanelMessageResponse(
+        replies=[MessageResponse(persona=p, message=r) for p, r in replies],
+        feedback=feedback
+    )
+
+@router.websocket("/ws/{session_id}")
+async def chat_socket(websocket: WebSocket, session_id: int, token: str = Query(...)):
+    # Browsers cannot set headers on sockets, so the JWT comes in the query string
+    # and is verified once for the lifetime of the connection
+    try:
+        user = await run_in_threadpool(get_user_from_token, token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    if await run_in_threadpool(get_session_owner, session_id) != user['id']:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    context = get_context(session_id)
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            try:
+                data = json.loads(frame.get("text") or frame.get("bytes") or "")
+            except ValueError:
+                data = None
+            if not isinstance(data, dict) or not isinstance(data.get("message", ""), str):
+                await websocket.send_json({"type": "error", "status": 400, "detail": 'Expected {"message": "<text>"}'})
+                continue
+            message = (data.get("message") or "").strip()
+            if not message:
+                await websocket.send_json({"type": "error", "detail": "Empty message"})
+                continue
+            try:
+                await run_in_threadpool(usage_limiter.check, user['id'])
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+                continue
+            # Socket turns bypass the HTTP middleware, so each one takes an llm admission slot
+            limiter = admission_limiters["llm"]
+            if not await limiter.acquire():
+                await websocket.send_json({
+                    "type": "error", "status": 503,
+                    "detail": "Server is busy. Please try again shortly.",
+                    "retry_after": limiter.retry_after()
+                })
+                continue
+            started = time.monotonic()
+            try:
+                set_usage_scope(user['id'], session_id)
+                await stream_turn(websocket, session_id, context, message)
+            finally:
+                limiter.release(time.monotonic() - started)
+    except WebSocketDisconnect:
+        pass
+
+async def stream_turn(websocket: WebSocket, session_id: int, context: dict, message: str):
+    add_user_message(session_id, message)
+    
+    scenario = context.get("scenario", "")
+    personas = context.get("personas", []) or ["Counterpart"]
+    
+    feedback_task = asyncio.ensure_future(run_in_threadpool(generate_instant_feedback, message, scenario))
+    # Until the reply is in memory, any exit (LLM error, disconnect, cancellation)
+    # takes the user message back out so the next turn doesn't see it twice
+    completed = False
+    try:
+        if len(personas) == 1:
+            responding_persona = personas[0]
+        else:
+            responding_persona, _ = await run_in_threadpool(
+                generate_coordinator_decision, session_id, personas, scenario, message
+            )
+        responding_persona = responding_persona or personas[0]
+        await websocket.send_json({"type": "persona", "persona": responding_persona})
+        
+        feedback_sent = False
+        chunks = []
+        stream = stream_persona_response(
+            session_id, responding_persona, scenario,
+            user_message=message, **persona_call_args(context, responding_persona)
+        )
+        try:
+            async for chunk in iterate_in_threadpool(stream):
+                chunks.append(chunk)
+                await websocket.send_json({"type": "token", "content": chunk})
+                if not feedback_sent and feedback_task.done():
+                    await websocket.send_json({"type": "feedback", "feedback": feedback_task.result()})
+                    feedback_sent = True
+        except LLMUnavailableError:
+            await websocket.send_json({
+                "type": "error", "status": 503,
+                "detail": "The AI is temporarily unavailable. Please try again shortly.",
+                "retry_after": llm_breaker.retry_after()
+            })
+            return
+        except InvalidPersonaError:
+            await websocket.send_json({"type": "error", "status": 400, "detail": "Invalid persona configuration"})
+            return
+        
+        feedback = await feedback_task
+        if not feedback_sent:
+            await websocket.send_json({"type": "feedback", "feedback": feedback})
+        
+        response = "".join(chunks)
+        add_ai_message(session_id, responding_persona, response)
+        completed = True
+    finally:
+        if not completed:
+            remove_last_message(session_id)
+            feedback_task.cancel()
+    await run_in_threadpool(
+        save_messages, session_id,
+        [("User", message, feedback), (responding_persona, response, None)]
+    )
+    await websocket.send_json({"type": "done", "persona": responding_persona, "message": response})
 
 @router.get("/messages/{session_id}", response_model=GetMessagesResponse)
-def get_messages(session_id: int, user=Depends(get_current_user)):
-    messages = get_session_messages(session_id)
-    return GetMessagesResponse(messages=messages)
+def get_messages(
+    session_id: int,
+    since_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    fields: Optional[str] = None,
+    compact: bool = False,
+    user=Depends(get_current_user)
+):
+    # Pollers pass the last id they saw as since_id to only receive new messages
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    messages = get_session_messages(session_id, since_id=since_id, limit=limit, fields=field_list)
+    if compact:
+        messages = [{k: v for k, v in msg.items() if v is not None} for msg in messages]
+    last_id = messages[-1]["id"] if messages else since_id
+    pending = get_context(session_id).get("opener_pending", False)
+    return GetMessagesResponse(messages=messages, last_id=last_id, pending=pending)
 
 @router.post("/end", response_model=EndSessionResponse)
-def end_session_route(request: EndSessionRequest, user=Depends(get_current_user)):
+def end_session_route(request: EndSessionRequest, user=Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return run_idempotent(user, "end", idempotency_key, lambda: process_end_session(request, user))
+
+def process_end_session(request: EndSessionRequest, user: dict):
+    begin_llm_request(user, request.session_id)
     context = get_context(request.session_id)
     scenario = context.get("scenario", "")
-    user_role = context.get("user_role")
-    user_personality = context.get("user_personality")
     
-    messages = get_session_messages(request.session_id)
-    evaluation = generate_evaluation(messages, scenario, user_role, user_personality)
+    # A degraded evaluation or summary would be stored and indexed for good, so the
+    # session stays open and the user can end it again once the LLM is back
+    evaluation = evaluate_session(request.session_id)
+    if evaluation == EVALUATION_UNAVAILABLE:
+        raise llm_unavailable()
     
     summary = generate_summary(request.session_id, scenario)
+    if summary == SUMMARY_UNAVAILABLE:
+        raise llm_unavailable()
     
     end_session(request.session_id)
     save_summary(request.session_id, summary, evaluation)
@@ -216,17 +512,31 @@ def save_summary_route(request: SaveSummaryRequest, user=Depends(get_current_use
     return {"status": "success"}
 
 @router.post("/evaluate")
-def generate_evaluation_route(request: GenerateEvaluationRequest, user=Depends(get_current_user)):
-    context = get_context(request.session_id)
-    scenario = context.get("scenario", "")
-    user_role = context.get("user_role")
-    user_personality = context.get("user_personality")
-    
-    messages = get_session_messages(request.session_id)
-    evaluation = generate_evaluation(messages, scenario, user_role, user_personality)
-    
+def generate_evaluation_route(request: GenerateEvaluationRequest, user=Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return run_idempotent(user, "evaluate", idempotency_key, lambda: process_evaluation(request, user))
+
+def process_evaluation(request: GenerateEvaluationRequest, user: dict):
+    begin_llm_request(user, request.session_id)
+    # The client saves whatever comes back as the session's evaluation, so a degraded one is an error
+    evaluation = evaluate_session(request.session_id)
+    if evaluation == EVALUATION_UNAVAILABLE:
+        raise llm_unavailable()
     return {"evaluation": evaluation}
 
+def evaluate_session(session_id: int):
+    # Memoized per session until a message is added or the prompt changes
+    key = (get_last_message_id(session_id), EVALUATION_PROMPT_VERSION)
+    context = get_context(session_id)
+    memo = context.get("evaluation")
+    if memo and memo[0] == key:
+        return memo[1]
+    
+    messages = get_session_messages(session_id)
+    evaluation = generate_evaluation(messages, context.get("scenario", ""), context.get("user_role"), context.get("user_personality"))
+    if evaluation != EVALUATION_UNAVAILABLE:
+        update_context(session_id, "evaluation", (key, evaluation))
+    return evaluation
+
 @router.delete("/delete/{session_id}", response_model=DeleteSessionResponse)
 def delete_session_route(session_id: int, user=Depends(get_current_user)):
     success = delete_session(session_id)
@@ -252,11 +562,49 @@ def get_history(user=Depends(get_current_user)):
 
     return {"sessions": formatted}
 
+@router.get("/stats")
+def get_stats(user=Depends(get_current_user)):
+    return get_user_stats(user['id'])
+
+@router.get("/search")
+def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    user=Depends(get_current_user)
+):
+    return search_history(user['id'], q, page, page_size)
+
 @router.post("/generate_scenario")
-def generate_scenario_route(request: GenerateScenarioRequest, user=Depends(get_current_user)):
+def generate_scenario_route(request: GenerateScenarioRequest, user=Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return run_idempotent(user, "generate_scenario", idempotency_key, lambda: process_generate_scenario(request, user))
+
+def process_generate_scenario(request: GenerateScenarioRequest, user: dict):
+    begin_llm_request(user)
     scenario = generate_scenario(request.role, request.difficulty, request.user_role, request.partner_role)
     return {"scenario": scenario}
 
 @router.post("/generate_transcript_summary")
-def generate_transcript_summary_route(request: GenerateTranscriptSummaryRequest, user=Depends(get_current_user)):
-    summary = generate_transcript_summary(request.transcript)
\ No newline at end of file
+def generate_transcript_summary_route(request: GenerateTranscriptSummaryRequest, user=Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return run_idempotent(user, "generate_transcript_summary", idempotency_key, lambda: process_transcript_summary(request, user))
+
+def process_transcript_summary(request: GenerateTranscriptSummaryRequest, user: dict):
+    begin_llm_request(user)
+    summary = generate_transcript_summary(request.transcript)
+    return {"summary": summary}
+
+@router.get("/cache_stats")
+def cache_stats(user=Depends(get_current_user)):
+    return llm_cache.stats()
+
+@router.get("/usage")
+def get_usage(days: int = Query(30, ge=1, le=365), user=Depends(get_current_user)):
+    return get_user_usage(user['id'], days)
+
+@router.get("/breaker_stats")
+def breaker_stats(user=Depends(get_current_user)):
+    return llm_breaker.stats()
+
+@router.get("/routing_stats")
+def routing_stats(user=Depends(get_current_user)):
+    return model_router.stats()
\ No newline at end of file
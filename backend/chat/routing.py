@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import defaultdict, deque
+from config import (LLM_CALL_CONFIG, LLM_ROUTING_WINDOW, LLM_ROUTING_MIN_SAMPLES,
+                    LLM_FALLBACK_P95_SECONDS, LLM_FALLBACK_ERROR_RATE, LLM_FALLBACK_COOLDOWN_SECONDS)
+
+class ModelRouter:
+    """
+    Picks the model, max_tokens and timeout for each call type.
+    Tracks a rolling window of latencies and errors for the primary model and
+    switches the call type to its fallback model for a cooldown period when the
+    window's p95 latency or error rate crosses the configured threshold.
+    """
+
+    def __init__(self, call_config: dict, window: int, min_samples: int,
+                 max_p95: float, max_error_rate: float, cooldown: float):
+        self.call_config = call_config
+        self.min_samples = min_samples
+        self.max_p95 = max_p95
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.fallback_until = {}
+        self.fallback_count = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def route(self, call_type: str):
+        config = self.call_config.get(call_type, {})
+        with self.lock:
+            use_fallback = self.fallback_until.get(call_type, 0) > time.monotonic()
+        model = config.get("fallback_model") if use_fallback else None
+        return {
+            "model": model or config.get("model"),
+            "max_tokens": config.get("max_tokens"),
+            "timeout": config.get("timeout")
+        }
+
+    def record(self, call_type: str, model: str, latency: float, ok: bool):
+        config = self.call_config.get(call_type, {})
+        # Only the primary model's health decides whether to fall back
+        if model != config.get("model"):
+            return
+        with self.lock:
+            window = self.samples[call_type]
+            window.append((latency, ok))
+            if len(window) < self.min_samples:
+                return
+            p95, error_rate = self._window_stats(window)
+            max_p95 = config.get("max_p95", self.max_p95)
+            if (p95 > max_p95 or error_rate > self.max_error_rate) and config.get("fallback_model"):
+                self.fallback_until[call_type] = time.monotonic() + self.cooldown
+                self.fallback_count[call_type] += 1
+                # The primary starts from a clean window once the cooldown ends
+                window.clear()
+
+    @staticmethod
+    def _window_stats(window):
+        latencies = sorted(latency for latency, _ in window)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        error_rate = sum(1 for _, ok in window if not ok) / len(window)
+        return p95, error_rate
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            result = {}
+            for call_type, config in self.call_config.items():
+                window = self.samples.get(call_type)
+                p95, error_rate = self._window_stats(window) if window else (None, None)
+                result[call_type] = {
+                    "model": config.get("model"),
+                    "fallback_model": config.get("fallback_model"),
+                    "on_fallback": self.fallback_until.get(call_type, 0) > now,
+                    "fallback_count": self.fallback_count[call_type],
+                    "samples": len(window) if window else 0,
+                    "p95_seconds": p95,
+                    "error_rate": error_rate
+                }
+            return result
+
+model_router = ModelRouter(LLM_CALL_CONFIG, LLM_ROUTING_WINDOW, LLM_ROUTING_MIN_SAMPLES,
+                           LLM_FALLBACK_P95_SECONDS, LLM_FALLBACK_ERROR_RATE, LLM_FALLBACK_COOLDOWN_SECONDS)
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar, copy_context
+from datetime import date
+from fastapi import HTTPException
+from config import USER_DAILY_TOKEN_BUDGET, USER_LLM_REQUESTS_PER_MINUTE
+from db.crud import record_llm_usage, get_daily_tokens
+
+logger = logging.getLogger(__name__)
+
+# Set by the chat routes so agent calls can be attributed without threading ids through every function
+usage_scope = ContextVar("usage_scope", default=None)
+
+def set_usage_scope(user_id: int, session_id: int = None):
+    usage_scope.set({"user_id": user_id, "session_id": session_id})
+
+def submit_in_scope(pool, fn, *args):
+    # Worker threads don't inherit context variables, so each task runs in a copy of the
+    # caller's context and its LLM usage is still attributed to the same user and session
+    return pool.submit(copy_context().run, fn, *args)
+
+class UsageLimiter:
+    """
+    Enforces per-user daily token budgets and LLM request rates before any
+    LLM call is made. Token totals are cached per day and seeded from the
+    user_usage_daily rollup the first time a user is seen that day.
+    """
+
+    def __init__(self, daily_tokens: int, per_minute: int):
+        self.daily_tokens = daily_tokens
+        self.per_minute = per_minute
+        self.requests = defaultdict(deque)
+        self.tokens = {}
+        self.lock = threading.Lock()
+
+    def _tokens_today(self, user_id: int):
+        today = date.today()
+        cached = self.tokens.get(user_id)
+        if cached is None or cached[0] != today:
+            cached = (today, get_daily_tokens(user_id, today))
+            self.tokens[user_id] = cached
+        return cached[1]
+
+    def check(self, user_id: int):
+        if self.daily_tokens and self._tokens_today(user_id) >= self.daily_tokens:
+            raise HTTPException(
+                status_code=429,
+                detail="Daily AI usage limit reached",
+                headers={"Retry-After": str(self._seconds_until_midnight())}
+            )
+        if not self.per_minute:
+            return
+        now = time.monotonic()
+        with self.lock:
+            window = self.requests[user_id]
+            while window and now - window[0] > 60:
+                window.popleft()
+            if len(window) >= self.per_minute:
+                retry_after = int(60 - (now - window[0])) + 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many AI requests, slow down",
+                    headers={"Retry-After": str(retry_after)}
+                )
+            window.append(now)
+
+    def add_tokens(self, user_id: int, tokens: int):
+        with self.lock:
+            day, used = self.tokens.get(user_id, (date.today(), 0))
+            if day != date.today():
+                day, used = date.today(), 0
+            self.tokens[user_id] = (day, used + tokens)
+
+    @staticmethod
+    def _seconds_until_midnight():
+        now = time.localtime()
+        return 86400 - (now.tm_hour * 3600 + now.tm_min * 60 + now.tm_sec)
+
+usage_limiter = UsageLimiter(USER_DAILY_TOKEN_BUDGET, USER_LLM_REQUESTS_PER_MINUTE)
+
+def record_usage(call_type: str, model: str, usage):
+    scope = usage_scope.get()
+    if usage is None or scope is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    usage_limiter.add_tokens(scope["user_id"], prompt_tokens + completion_tokens)
+    try:
+        record_llm_usage(scope["user_id"], scope["session_id"], call_type, model,
+                         prompt_tokens, completion_tokens)
+    except Exception:
+        # Accounting must never break a chat turn
+        logger.exception("Failed to record LLM usage")
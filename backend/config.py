@@ -1,4 +1,5 @@
 from dotenv import load_dotenv
+import json
 import os
 
 load_dotenv()
@@ -10,3 +11,62 @@ JWT_EXPIRATION_MINUTES = int(os.getenv("JWT_EXPIRATION_MINUTES", 10080))
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "").strip()
 GROQ_MODEL = os.getenv("GROQ_MODEL", "openai/gpt-oss-120b").strip()
 WHOP_API_KEY = os.getenv("WHOP_API_KEY", "").strip()
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 1024))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "").strip()
+LLM_CACHE_DISK_SIZE = int(os.getenv("LLM_CACHE_DISK_SIZE", 20000))
+MEMORY_MAX_MESSAGES = int(os.getenv("MEMORY_MAX_MESSAGES", 32))
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 600))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", 10000))
+IDEMPOTENCY_WAIT_SECONDS = int(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 120))
+
+# Per-call-type model routing. Every key can be overridden with the LLM_CALL_CONFIG
+# env var, e.g. '{"feedback": {"model": "llama-3.1-8b-instant", "timeout": 5}}'
+GROQ_FAST_MODEL = os.getenv("GROQ_FAST_MODEL", "openai/gpt-oss-20b").strip()
+GROQ_FALLBACK_MODEL = os.getenv("GROQ_FALLBACK_MODEL", "llama-3.3-70b-versatile").strip()
+LLM_CALL_CONFIG = {
+    "persona": {"model": GROQ_MODEL, "fallback_model": GROQ_FALLBACK_MODEL, "max_tokens": 1024, "timeout": 30},
+    "opener": {"model": GROQ_MODEL, "fallback_model": GROQ_FALLBACK_MODEL, "max_tokens": 1024, "timeout": 30},
+    "coordinator": {"model": GROQ_FAST_MODEL, "fallback_model": GROQ_MODEL, "max_tokens": 256, "timeout": 10},
+    "panel": {"model": GROQ_FAST_MODEL, "fallback_model": GROQ_MODEL, "max_tokens": 256, "timeout": 10},
+    "feedback": {"model": GROQ_FAST_MODEL, "fallback_model": GROQ_MODEL, "max_tokens": 512, "timeout": 15},
+    "scenario": {"model": GROQ_FAST_MODEL, "fallback_model": GROQ_MODEL, "max_tokens": 256, "timeout": 15},
+    "evaluation": {"model": GROQ_MODEL, "fallback_model": GROQ_FALLBACK_MODEL, "max_tokens": 1024, "timeout": 45},
+    "summary": {"model": GROQ_MODEL, "fallback_model": GROQ_FALLBACK_MODEL, "max_tokens": 512, "timeout": 30},
+    "transcript_summary": {"model": GROQ_MODEL, "fallback_model": GROQ_FALLBACK_MODEL, "max_tokens": 512, "timeout": 30},
+    "transcript_chunk": {"model": GROQ_FAST_MODEL, "fallback_model": GROQ_MODEL, "max_tokens": 256, "timeout": 20},
+}
+for _call_type, _overrides in json.loads(os.getenv("LLM_CALL_CONFIG", "{}")).items():
+    LLM_CALL_CONFIG.setdefault(_call_type, {}).update(_overrides)
+LLM_ROUTING_WINDOW = int(os.getenv("LLM_ROUTING_WINDOW", 50))
+LLM_ROUTING_MIN_SAMPLES = int(os.getenv("LLM_ROUTING_MIN_SAMPLES", 10))
+LLM_FALLBACK_P95_SECONDS = float(os.getenv("LLM_FALLBACK_P95_SECONDS", 10))
+LLM_FALLBACK_ERROR_RATE = float(os.getenv("LLM_FALLBACK_ERROR_RATE", 0.3))
+LLM_FALLBACK_COOLDOWN_SECONDS = float(os.getenv("LLM_FALLBACK_COOLDOWN_SECONDS", 60))
+
+# Per-user LLM capacity limits; 0 disables a limit
+USER_DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", 200000))
+USER_LLM_REQUESTS_PER_MINUTE = int(os.getenv("USER_LLM_REQUESTS_PER_MINUTE", 30))
+
+# Circuit breaker around the LLM backend
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", 20))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", 5))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", 0.5))
+LLM_BREAKER_SLOW_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_SECONDS", 20))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", 30))
+
+# Optional read replica for history/transcript reads
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL", "").strip()
+REPLICA_LAG_SECONDS = float(os.getenv("REPLICA_LAG_SECONDS", 5))
+
+# Long transcripts are summarized chunk by chunk, then the partial summaries are merged
+TRANSCRIPT_CHUNK_TOKENS = int(os.getenv("TRANSCRIPT_CHUNK_TOKENS", 1500))
+TRANSCRIPT_SUMMARY_CONCURRENCY = int(os.getenv("TRANSCRIPT_SUMMARY_CONCURRENCY", 4))
+# Merging fewer than two summaries per call would never shrink the list
+TRANSCRIPT_REDUCE_FANIN = max(2, int(os.getenv("TRANSCRIPT_REDUCE_FANIN", 6)))
+
+# Admission control: concurrent requests and bounded wait queue per route class
+ADMISSION_LLM_CONCURRENCY = int(os.getenv("ADMISSION_LLM_CONCURRENCY", 24))
+ADMISSION_LLM_QUEUE = int(os.getenv("ADMISSION_LLM_QUEUE", 32))
+ADMISSION_READ_CONCURRENCY = int(os.getenv("ADMISSION_READ_CONCURRENCY", 64))
+ADMISSION_READ_QUEUE = int(os.getenv("ADMISSION_READ_QUEUE", 256))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", 5))
@@ -0,0 +1,113 @@
+"""
+Packs the messages of ended sessions into one compressed blob per session.
+
+    python -m db.archive --days 30
+
+Archived sessions keep their search index, stats and summary; only the
+message rows move into session_archives, and get_session_messages reads
+them back transparently. A later write to the session restores its rows.
+"""
+import argparse
+import json
+import time
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from db.database import SessionLocal, init_db
+from db.models import Session, Message, SessionArchive
+
+def pack_messages(messages: list):
+    raw = json.dumps([
+        {
+            "id": m.id,
+            "type": m.type,
+            "content": m.content,
+            "persona": m.persona,
+            "feedback": m.feedback,
+            "timestamp": m.timestamp.isoformat() if m.timestamp else None
+        }
+        for m in messages
+    ], separators=(",", ":")).encode("utf-8")
+    return raw, zlib.compress(raw, 9)
+
+def unpack_messages(payload: bytes):
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+def restore_messages(db, session_id: int):
+    # Writing to an archived session moves its messages back to live rows first, so the
+    # session never has messages in both places; the caller commits
+    archive = db.get(SessionArchive, session_id)
+    if archive is None:
+        return
+    db.add_all([
+        Message(id=m["id"], session_id=session_id, type=m["type"], content=m["content"],
+                persona=m["persona"], feedback=m["feedback"],
+                timestamp=datetime.fromisoformat(m["timestamp"]) if m["timestamp"] else None)
+        for m in unpack_messages(archive.payload)
+    ])
+    db.delete(archive)
+    db.flush()
+
+def time_hot_query(db, samples: int = 50):
+    # Median latency of the transcript query for the most recent sessions that still have rows
+    session_ids = [row[0] for row in db.query(Message.session_id).distinct().order_by(Message.session_id.desc()).limit(samples)]
+    timings = []
+    for session_id in session_ids:
+        started = time.perf_counter()
+        db.query(Message.id, Message.content).filter(Message.session_id == session_id).order_by(Message.id).all()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000 if timings else 0.0
+
+def archive_sessions(days: int, batch_size: int = 100):
+    init_db()
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    db = SessionLocal()
+    try:
+        hot_rows_before = db.query(func.count(Message.id)).scalar()
+        latency_before = time_hot_query(db)
+
+        archived_ids = db.query(SessionArchive.session_id)
+        candidates = [row[0] for row in (db.query(Session.id)
+                                         .filter(Session.is_active == False, Session.created_at < cutoff,
+                                                 ~Session.id.in_(archived_ids))
+                                         .all())]
+        sessions = raw_total = compressed_total = moved = 0
+        for session_id in candidates:
+            messages = db.query(Message).filter(Message.session_id == session_id).order_by(Message.id).all()
+            if not messages:
+                continue
+            raw, compressed = pack_messages(messages)
+            db.add(SessionArchive(session_id=session_id, payload=compressed, message_count=len(messages),
+                                  raw_bytes=len(raw), compressed_bytes=len(compressed),
+                                  archived_at=datetime.utcnow()))
+            db.query(Message).filter(Message.session_id == session_id).delete(synchronize_session=False)
+            sessions += 1
+            moved += len(messages)
+            raw_total += len(raw)
+            compressed_total += len(compressed)
+            if sessions % batch_size == 0:
+                db.commit()
+        db.commit()
+
+        return {
+            "sessions_archived": sessions,
+            "messages_moved": moved,
+            "raw_bytes": raw_total,
+            "compressed_bytes": compressed_total,
+            "bytes_saved": raw_total - compressed_total,
+            "compression_ratio": round(raw_total / compressed_total, 2) if compressed_total else None,
+            "hot_rows_before": hot_rows_before,
+            "hot_rows_after": hot_rows_before - moved,
+            "hot_query_ms_before": round(latency_before, 3),
+            "hot_query_ms_after": round(time_hot_query(db), 3)
+        }
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=30, help="archive ended sessions older than this")
+    args = parser.parse_args()
+    for key, value in archive_sessions(args.days).items():
+        print(f"{key:22} {value}")
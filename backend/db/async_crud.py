@@ -0,0 +1,127 @@
+"""
+Async counterparts of db.crud for the event loop.
+
+Each function runs the same query code as its sync twin through
+AsyncSession.run_sync, so only the wrappers can fall out of step; the
+connection itself is driven by aiosqlite/asyncpg without a worker thread.
+The async engines are built when this module is first imported.
+
+The routes still use db.crud: benchmarks/crud_throughput.py measured no
+gain on Postgres and half the throughput on SQLite.
+"""
+from datetime import date
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from config import READ_DATABASE_URL
+from db import crud
+from db.database import SQLALCHEMY_DATABASE_URL, recently_written
+
+def async_url(url):
+    # Same database, async driver: aiosqlite for SQLite, asyncpg for Postgres
+    url = make_url(url)
+    connect_args = {}
+    if url.drivername.startswith("sqlite"):
+        url = url.set(drivername="sqlite+aiosqlite")
+    elif url.drivername.startswith("postgres"):
+        sslmode = url.query.get("sslmode")
+        url = url.set(drivername="postgresql+asyncpg").difference_update_query(["sslmode", "channel_binding"])
+        if sslmode and sslmode != "disable":
+            connect_args["ssl"] = sslmode
+    return url, connect_args
+
+def make_async_sessionmaker(url):
+    url, connect_args = async_url(url)
+    async_engine = create_async_engine(url, connect_args=connect_args)
+    return async_engine, async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+async_engine, AsyncSessionLocal = make_async_sessionmaker(SQLALCHEMY_DATABASE_URL)
+if READ_DATABASE_URL:
+    async_read_engine, AsyncReadSessionLocal = make_async_sessionmaker(READ_DATABASE_URL)
+else:
+    async_read_engine, AsyncReadSessionLocal = async_engine, AsyncSessionLocal
+
+def get_async_read_session(*keys):
+    if AsyncReadSessionLocal is AsyncSessionLocal or recently_written(*keys):
+        return AsyncSessionLocal()
+    return AsyncReadSessionLocal()
+
+async def run_in_async_session(db, fn, *args):
+    async with db:
+        return await db.run_sync(fn, *args)
+
+async def get_user_by_username(username: str):
+    return await run_in_async_session(get_async_read_session(("username", username)), crud._get_user_by_username, username)
+
+async def create_user(username: str, role: str, age: int = None):
+    return await run_in_async_session(AsyncSessionLocal(), crud._create_user, username, role, age)
+
+async def create_session(
+    user_id: int, 
+    scenario: str, 
+    personas: list,
+    user_role: str = None,
+    partner_role: str = None,
+    user_personality: str = None,
+    partner_personality: str = None
+):
+    return await run_in_async_session(
+        AsyncSessionLocal(), crud._create_session,
+        user_id, scenario, personas, user_role, partner_role, user_personality, partner_personality
+    )
+
+async def save_message(session_id: int, persona: str, message: str, feedback: dict = None):
+    return await run_in_async_session(AsyncSessionLocal(), crud._save_message, session_id, persona, message, feedback)
+
+async def save_messages(session_id: int, messages: list):
+    return await run_in_async_session(AsyncSessionLocal(), crud._save_messages, session_id, messages)
+
+async def set_message_feedback(message_id: int, feedback: dict):
+    return await run_in_async_session(AsyncSessionLocal(), crud._set_message_feedback, message_id, feedback)
+
+async def get_message_feedback(message_id: int):
+    return await run_in_async_session(AsyncSessionLocal(), crud._get_message_feedback, message_id)
+
+async def get_session_owner(session_id: int):
+    return await run_in_async_session(get_async_read_session(("session", session_id)), crud._get_session_owner, session_id)
+
+async def get_last_message_id(session_id: int):
+    return await run_in_async_session(get_async_read_session(("session", session_id)), crud._get_last_message_id, session_id)
+
+async def get_session_messages(session_id: int, since_id: int = None, limit: int = None, fields: list = None):
+    return await run_in_async_session(
+        get_async_read_session(("session", session_id)), crud._get_session_messages,
+        session_id, since_id, limit, fields
+    )
+
+async def end_session(session_id: int):
+    return await run_in_async_session(AsyncSessionLocal(), crud._end_session, session_id)
+
+async def save_summary(session_id: int, summary: str, evaluation: str):
+    return await run_in_async_session(AsyncSessionLocal(), crud._save_summary, session_id, summary, evaluation)
+
+async def get_user_sessions(user_id: int):
+    return await run_in_async_session(get_async_read_session(("user", user_id)), crud._get_user_sessions, user_id)
+
+async def delete_session(session_id: int):
+    return await run_in_async_session(AsyncSessionLocal(), crud._delete_session, session_id)
+
+async def get_user_stats(user_id: int, recent: int = 20, weakest: int = 5):
+    return await run_in_async_session(get_async_read_session(("user", user_id)), crud._get_user_stats, user_id, recent, weakest)
+
+async def search_history(user_id: int, query: str, page: int = 1, page_size: int = 20):
+    return await run_in_async_session(
+        get_async_read_session(("user", user_id)), crud._search_history,
+        user_id, query, page, page_size
+    )
+
+async def record_llm_usage(user_id: int, session_id: int, call_type: str, model: str, prompt_tokens: int, completion_tokens: int):
+    return await run_in_async_session(
+        AsyncSessionLocal(), crud._record_llm_usage,
+        user_id, session_id, call_type, model, prompt_tokens, completion_tokens
+    )
+
+async def get_daily_tokens(user_id: int, day: date):
+    return await run_in_async_session(get_async_read_session(("user", user_id)), crud._get_daily_tokens, user_id, day)
+
+async def get_user_usage(user_id: int, days: int = 30):
+    return await run_in_async_session(get_async_read_session(("user", user_id)), crud._get_user_usage, user_id, days)
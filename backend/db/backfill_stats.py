@@ -0,0 +1,53 @@
+"""
+Rebuilds user_stats and session_stats from sessions, messages and session archives.
+
+    python -m db.backfill_stats
+"""
+from collections import defaultdict
+from db.database import SessionLocal, init_db
+from db.models import Session, Message, UserStats, SessionStats, SessionArchive
+from db.archive import unpack_messages
+from db.crud import _feedback_score
+
+def backfill():
+    init_db()
+    db = SessionLocal()
+    try:
+        db.query(SessionStats).delete()
+        db.query(UserStats).delete()
+
+        users = defaultdict(lambda: {"session_count": 0, "completed_sessions": 0,
+                                     "message_count": 0, "scored_count": 0, "score_sum": 0})
+        for session in db.query(Session).yield_per(500):
+            stats = SessionStats(session_id=session.id, user_id=session.user_id, scenario=session.scenario,
+                                 created_at=session.created_at, completed=session.summary is not None,
+                                 message_count=0, scored_count=0, score_sum=0)
+            archive = db.get(SessionArchive, session.id)
+            feedbacks = [m["feedback"] for m in unpack_messages(archive.payload)] if archive else []
+            feedbacks += [feedback for (feedback,) in (db.query(Message.feedback)
+                                                       .filter(Message.session_id == session.id)
+                                                       .order_by(Message.id).all())]
+            for feedback in feedbacks:
+                stats.message_count += 1
+                score = _feedback_score(feedback)
+                if score is not None:
+                    stats.scored_count += 1
+                    stats.score_sum += score
+                    stats.last_score = score
+            db.add(stats)
+
+            totals = users[session.user_id]
+            totals["session_count"] += 1
+            totals["completed_sessions"] += 1 if stats.completed else 0
+            totals["message_count"] += stats.message_count
+            totals["scored_count"] += stats.scored_count
+            totals["score_sum"] += stats.score_sum
+
+        db.add_all([UserStats(user_id=user_id, **totals) for user_id, totals in users.items()])
+        db.commit()
+        return len(users)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    print(f"Rebuilt stats for {backfill()} users")
@@ -1,26 +1,123 @@
 from sqlalchemy.orm import Session
-from db.database import SessionLocal
-from db.models import User, Session, Message
-from datetime import datetime
+from db.database import SessionLocal, get_read_session, mark_write, run_in_session
+from db.search import index_document, remove_documents, search_documents
+from db.models import User, Session, Message, UserStats, SessionStats, LLMUsage, UserUsageDaily, SessionArchive
+from db.archive import restore_messages, unpack_messages
+from datetime import datetime, date, timedelta
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 import json
 
+def _feedback_score(feedback):
+    # Failed feedback calls store score 0 and degraded rule-based feedback is a guess;
+    # neither is a real rating
+    if not isinstance(feedback, dict) or feedback.get("degraded"):
+        return None
+    score = feedback.get("score")
+    if isinstance(score, (int, float)) and score > 0:
+        return int(score)
+    return None
+
+def _ensure_session_stats(db, session_id: int):
+    if db.get(SessionStats, session_id) is not None:
+        return True
+    session = db.get(Session, session_id)
+    if session is None:
+        return False
+    if db.get(UserStats, session.user_id) is None:
+        db.add(UserStats(user_id=session.user_id, session_count=0, completed_sessions=0,
+                         message_count=0, scored_count=0, score_sum=0))
+    db.add(SessionStats(session_id=session_id, user_id=session.user_id, scenario=session.scenario,
+                        created_at=session.created_at, completed=session.summary is not None,
+                        message_count=0, scored_count=0, score_sum=0))
+    db.flush()
+    db.query(UserStats).filter(UserStats.user_id == session.user_id).update(
+        {UserStats.session_count: UserStats.session_count + 1,
+         UserStats.completed_sessions: UserStats.completed_sessions + (1 if session.summary is not None else 0)},
+        synchronize_session=False
+    )
+    return True
+
+def _record_message_stats(db, session_id: int, feedbacks: list, new_messages: int = None):
+    # Counters are bumped with UPDATE ... SET x = x + n in the caller's transaction.
+    # new_messages=0 scores feedback attached to messages that were already counted
+    if not _ensure_session_stats(db, session_id):
+        return
+    if new_messages is None:
+        new_messages = len(feedbacks)
+    scores = [score for score in (_feedback_score(f) for f in feedbacks) if score is not None]
+    session_values = {
+        SessionStats.message_count: SessionStats.message_count + new_messages,
+        SessionStats.scored_count: SessionStats.scored_count + len(scores),
+        SessionStats.score_sum: SessionStats.score_sum + sum(scores)
+    }
+    if scores:
+        session_values[SessionStats.last_score] = scores[-1]
+    db.query(SessionStats).filter(SessionStats.session_id == session_id).update(
+        session_values, synchronize_session=False
+    )
+    user_id = db.get(SessionStats, session_id).user_id
+    db.query(UserStats).filter(UserStats.user_id == user_id).update(
+        {UserStats.message_count: UserStats.message_count + new_messages,
+         UserStats.scored_count: UserStats.scored_count + len(scores),
+         UserStats.score_sum: UserStats.score_sum + sum(scores),
+         UserStats.updated_at: datetime.utcnow()},
+        synchronize_session=False
+    )
+
+def _get_user_by_username(db, username: str):
+    return db.query(User).filter(User.username == username).first()
+
 def get_user_by_username(username: str):
-    db = SessionLocal()
-    try:
-        return db.query(User).filter(User.username == username).first()
-    finally:
-        db.close()
+    return run_in_session(get_read_session(("username", username)), _get_user_by_username, username)
+
+def _index_messages(db, session_id: int, db_msgs: list):
+    user_id = db.query(Session.user_id).filter(Session.id == session_id).scalar()
+    if user_id is None:
+        return
+    for db_msg in db_msgs:
+        index_document(db, "message", user_id, session_id, db_msg.content, db_msg.id)
+
+def _create_user(db, username: str, role: str, age: int = None):
+    user = User(username=username, role=role, age=age)
+    db.add(user)
+    db.commit()
+    mark_write(("username", username))
+    db.refresh(user)
+    return user
 
 def create_user(username: str, role: str, age: int = None):
-    db = SessionLocal()
-    try:
-        user = User(username=username, role=role, age=age)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-        return user
-    finally:
-        db.close()
+    return run_in_session(SessionLocal(), _create_user, username, role, age)
+
+def _create_session(
+    db,
+    user_id: int, 
+    scenario: str, 
+    personas: list,
+    user_role: str = None,
+    partner_role: str = None,
+    user_personality: str = None,
+    partner_personality: str = None
+):
+    db_session = Session(
+        user_id=user_id, 
+        scenario=scenario, 
+        personas=personas,
+        created_at=datetime.utcnow(),
+        is_active=True,
+        user_role=user_role,
+        partner_role=partner_role,
+        user_personality=user_personality,
+        partner_personality=partner_personality
+    )
+    db.add(db_session)
+    db.flush()
+    _ensure_session_stats(db, db_session.id)
+    index_document(db, "scenario", user_id, db_session.id, scenario)
+    db.commit()
+    mark_write(("session", db_session.id), ("user", user_id))
+    db.refresh(db_session)
+    return db_session.id
 
 def create_session(
     user_id: int, 
@@ -31,107 +128,347 @@ def create_session(
     user_personality: str = None,
     partner_personality: str = None
 ):
-    db = SessionLocal()
-    try:
-        db_session = Session(
-            user_id=user_id, 
-            scenario=scenario, 
-            personas=personas,
-            created_at=datetime.utcnow(),
-            is_active=True,
-            user_role=user_role,
-            partner_role=partner_role,
-            user_personality=user_personality,
-            partner_personality=partner_personality
-        )
-        db.add(db_session)
-        db.commit()
-        db.refresh(db_session)
-        return db_session.id
-    finally:
-        db.close()
+    return run_in_session(
+        SessionLocal(), _create_session,
+        user_id, scenario, personas, user_role, partner_role, user_personality, partner_personality
+    )
+
+def _save_message(db, session_id: int, persona: str, message: str, feedback: dict = None):
+    restore_messages(db, session_id)
+    msg_type = 'human' if persona == 'User' else 'ai'
+    db_msg = Message(
+        session_id=session_id,
+        type=msg_type,
+        content=message,
+        persona=persona if msg_type == 'ai' else None,
+        feedback=feedback,
+        timestamp=datetime.utcnow()
+    )
+    db.add(db_msg)
+    db.flush()
+    _record_message_stats(db, session_id, [feedback])
+    _index_messages(db, session_id, [db_msg])
+    db.commit()
+    mark_write(("session", session_id))
 
 def save_message(session_id: int, persona: str, message: str, feedback: dict = None):
-    db = SessionLocal()
-    try:
-        msg_type = 'human' if persona == 'User' else 'ai'
-        db_msg = Message(
+    return run_in_session(SessionLocal(), _save_message, session_id, persona, message, feedback)
+
+# messages is a list of (persona, message, feedback) tuples written in one transaction
+def _save_messages(db, session_id: int, messages: list):
+    restore_messages(db, session_id)
+    now = datetime.utcnow()
+    db_msgs = [
+        Message(
             session_id=session_id,
-            type=msg_type,
+            type='human' if persona == 'User' else 'ai',
             content=message,
-            persona=persona if msg_type == 'ai' else None,
+            persona=persona if persona != 'User' else None,
             feedback=feedback,
-            timestamp=datetime.utcnow()
+            timestamp=now
         )
-        db.add(db_msg)
-        db.commit()
-    finally:
-        db.close()
+        for persona, message, feedback in messages
+    ]
+    db.add_all(db_msgs)
+    db.flush()
+    _record_message_stats(db, session_id, [feedback for _, _, feedback in messages])
+    _index_messages(db, session_id, db_msgs)
+    db.commit()
+    mark_write(("session", session_id))
+    return [db_msg.id for db_msg in db_msgs]
 
-def get_session_messages(session_id: int):
-    db = SessionLocal()
-    try:
-        messages = db.query(Message).filter(Message.session_id == session_id).order_by(Message.timestamp).all()
-        return [
-            {
-                "role": "user" if msg.type == "human" else "assistant",
-                "content": msg.content,
-                "persona": msg.persona,
-                "feedback": msg.feedback
-            }
-            for msg in messages
-        ]
-    finally:
-        db.close()
+def save_messages(session_id: int, messages: list):
+    return run_in_session(SessionLocal(), _save_messages, session_id, messages)
+
+def _set_message_feedback(db, message_id: int, feedback: dict):
+    db_msg = db.get(Message, message_id)
+    if db_msg is None:
+        return False
+    db_msg.feedback = feedback
+    db.flush()
+    _record_message_stats(db, db_msg.session_id, [feedback], new_messages=0)
+    db.commit()
+    mark_write(("session", db_msg.session_id))
+    return True
+
+def set_message_feedback(message_id: int, feedback: dict):
+    return run_in_session(SessionLocal(), _set_message_feedback, message_id, feedback)
+
+# Polled right after the background write, so this reads the primary rather than the replica
+def _get_message_feedback(db, message_id: int):
+    row = (
+        db.query(Message.session_id, Message.feedback, Session.user_id)
+        .join(Session, Session.id == Message.session_id)
+        .filter(Message.id == message_id)
+        .first()
+    )
+    if row is None:
+        return None
+    return {"session_id": row.session_id, "user_id": row.user_id, "feedback": row.feedback}
+
+def get_message_feedback(message_id: int):
+    return run_in_session(SessionLocal(), _get_message_feedback, message_id)
+
+def _get_session_owner(db, session_id: int):
+    return db.query(Session.user_id).filter(Session.id == session_id).scalar()
+
+def get_session_owner(session_id: int):
+    return run_in_session(get_read_session(("session", session_id)), _get_session_owner, session_id)
+
+def _get_last_message_id(db, session_id: int):
+    # None for sessions without live rows, including archived ones, whose messages no longer change
+    return db.query(func.max(Message.id)).filter(Message.session_id == session_id).scalar()
+
+def get_last_message_id(session_id: int):
+    return run_in_session(get_read_session(("session", session_id)), _get_last_message_id, session_id)
+
+MESSAGE_FIELDS = ("id", "role", "content", "persona", "feedback")
+
+def _get_session_messages(db, session_id: int, since_id: int = None, limit: int = None, fields: list = None):
+    # id is always returned so callers can use it as the next cursor
+    fields = ["id"] + [f for f in (fields or MESSAGE_FIELDS) if f in MESSAGE_FIELDS and f != "id"]
+    columns = {
+        "id": Message.id,
+        "role": Message.type,
+        "content": Message.content,
+        "persona": Message.persona,
+        "feedback": Message.feedback
+    }
+    # Only the projected columns are read; (session_id, id) keeps this an index range scan
+    query = db.query(*[columns[f] for f in fields]).filter(Message.session_id == session_id)
+    if since_id is not None:
+        query = query.filter(Message.id > since_id)
+    query = query.order_by(Message.id)
+    if limit:
+        query = query.limit(limit)
+    rows = query.all()
+    if not rows:
+        # Ended sessions may have been packed into session_archives
+        archive = db.get(SessionArchive, session_id)
+        if archive is not None:
+            return _archived_messages(archive, fields, since_id, limit)
+    results = []
+    for row in rows:
+        item = dict(zip(fields, row))
+        if "role" in item:
+            item["role"] = "user" if item["role"] == "human" else "assistant"
+        results.append(item)
+    return results
+
+def get_session_messages(session_id: int, since_id: int = None, limit: int = None, fields: list = None):
+    return run_in_session(get_read_session(("session", session_id)), _get_session_messages, session_id, since_id, limit, fields)
+
+def _archived_messages(archive, fields: list, since_id: int = None, limit: int = None):
+    messages = [m for m in unpack_messages(archive.payload) if since_id is None or m["id"] > since_id]
+    if limit:
+        messages = messages[:limit]
+    results = []
+    for m in messages:
+        m["role"] = "user" if m["type"] == "human" else "assistant"
+        results.append({f: m.get(f) for f in fields})
+    return results
+
+def _end_session(db, session_id: int):
+    session = db.query(Session).filter(Session.id == session_id).first()
+    if session:
+        session.is_active = False
+        mark_write(("session", session_id), ("user", session.user_id))
+        db.commit()
 
 def end_session(session_id: int):
-    db = SessionLocal()
-    try:
-        session = db.query(Session).filter(Session.id == session_id).first()
-        if session:
-            session.is_active = False
-            db.commit()
-    finally:
-        db.close()
+    return run_in_session(SessionLocal(), _end_session, session_id)
+
+def _save_summary(db, session_id: int, summary: str, evaluation: str):
+    session = db.query(Session).filter(Session.id == session_id).first()
+    if session:
+        session.summary = summary
+        session.evaluation = evaluation
+        remove_documents(db, session_id, kind="summary")
+        index_document(db, "summary", session.user_id, session_id, summary)
+        if _ensure_session_stats(db, session_id):
+            stats = db.get(SessionStats, session_id)
+            if not stats.completed:
+                stats.completed = True
+                db.query(UserStats).filter(UserStats.user_id == stats.user_id).update(
+                    {UserStats.completed_sessions: UserStats.completed_sessions + 1,
+                     UserStats.updated_at: datetime.utcnow()},
+                    synchronize_session=False
+                )
+        mark_write(("session", session_id), ("user", session.user_id))
+        db.commit()
 
 def save_summary(session_id: int, summary: str, evaluation: str):
-    db = SessionLocal()
-    try:
-        session = db.query(Session).filter(Session.id == session_id).first()
-        if session:
-            session.summary = summary
-            session.evaluation = evaluation
-            db.commit()
-    finally:
-        db.close()
+    return run_in_session(SessionLocal(), _save_summary, session_id, summary, evaluation)
+
+def _get_user_sessions(db, user_id: int):
+    sessions = db.query(Session).filter(Session.user_id == user_id).order_by(Session.created_at.desc()).all()
+    session_ids = [s.id for s in sessions]
+    # Counted in two grouped queries instead of loading every session's messages
+    message_counts = dict(
+        db.query(Message.session_id, func.count(Message.id))
+        .filter(Message.session_id.in_(session_ids))
+        .group_by(Message.session_id).all()
+    ) if session_ids else {}
+    archived_counts = dict(
+        db.query(SessionArchive.session_id, SessionArchive.message_count)
+        .filter(SessionArchive.session_id.in_(session_ids)).all()
+    ) if session_ids else {}
+    results = []
+    for s in sessions:
+        results.append({
+            "id": s.id,
+            "scenario": s.scenario,
+            "personas": s.personas,
+            "created_at": s.created_at,
+            "summary": s.summary,
+            "evaluation": s.evaluation,
+            "message_count": message_counts.get(s.id) or archived_counts.get(s.id, 0)
+        })
+    return results
 
 def get_user_sessions(user_id: int):
-    db = SessionLocal()
-    try:
-        sessions = db.query(Session).filter(Session.user_id == user_id).order_by(Session.created_at.desc()).all()
-        results = []
-        for s in sessions:
-            results.append({
-                "id": s.id,
-                "scenario": s.scenario,
-                "personas": s.personas,
-                "created_at": s.created_at,
-                "summary": s.summary,
-                "evaluation": s.evaluation,
-                "message_count": len(s.messages)
-            })
-        return results
-    finally:
-        db.close()
+    return run_in_session(get_read_session(("user", user_id)), _get_user_sessions, user_id)
+
+def _delete_session(db, session_id: int):
+    session = db.query(Session).filter(Session.id == session_id).first()
+    if session:
+        stats = db.get(SessionStats, session_id)
+        if stats is not None:
+            db.query(UserStats).filter(UserStats.user_id == stats.user_id).update(
+                {UserStats.session_count: UserStats.session_count - 1,
+                 UserStats.completed_sessions: UserStats.completed_sessions - (1 if stats.completed else 0),
+                 UserStats.message_count: UserStats.message_count - stats.message_count,
+                 UserStats.scored_count: UserStats.scored_count - stats.scored_count,
+                 UserStats.score_sum: UserStats.score_sum - stats.score_sum,
+                 UserStats.updated_at: datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.delete(stats)
+        remove_documents(db, session_id)
+        db.query(SessionArchive).filter(SessionArchive.session_id == session_id).delete(synchronize_session=False)
+        mark_write(("session", session_id), ("user", session.user_id))
+        db.delete(session)
+        db.commit()
+        return True
+    return False
 
 def delete_session(session_id: int):
-    db = SessionLocal()
+    return run_in_session(SessionLocal(), _delete_session, session_id)
+
+def _get_user_stats(db, user_id: int, recent: int = 20, weakest: int = 5):
+    totals = db.get(UserStats, user_id)
+    by_recency = (db.query(SessionStats)
+                  .filter(SessionStats.user_id == user_id)
+                  .order_by(SessionStats.created_at.desc())
+                  .limit(recent).all())
+    scored = (db.query(SessionStats)
+              .filter(SessionStats.user_id == user_id, SessionStats.scored_count > 0)
+              .order_by((SessionStats.score_sum * 1.0 / SessionStats.scored_count).asc())
+              .limit(weakest).all())
+
+    def session_view(s):
+        return {
+            "session_id": s.session_id,
+            "scenario": s.scenario,
+            "created_at": s.created_at,
+            "message_count": s.message_count,
+            "average_score": s.score_sum / s.scored_count if s.scored_count else None,
+            "last_score": s.last_score
+        }
+
+    return {
+        "session_count": totals.session_count if totals else 0,
+        "completed_sessions": totals.completed_sessions if totals else 0,
+        "message_count": totals.message_count if totals else 0,
+        "average_score": totals.score_sum / totals.scored_count if totals and totals.scored_count else None,
+        "trend": [session_view(s) for s in reversed(by_recency)],
+        "weakest_sessions": [session_view(s) for s in scored]
+    }
+
+def get_user_stats(user_id: int, recent: int = 20, weakest: int = 5):
+    return run_in_session(get_read_session(("user", user_id)), _get_user_stats, user_id, recent, weakest)
+
+def _search_history(db, user_id: int, query: str, page: int = 1, page_size: int = 20):
+    # Fetch one extra row to know whether another page exists
+    rows = search_documents(db, user_id, query, page_size + 1, (page - 1) * page_size)
+    session_ids = {row["session_id"] for row in rows}
+    scenarios = dict(db.query(Session.id, Session.scenario).filter(Session.id.in_(session_ids)).all()) if session_ids else {}
+    for row in rows:
+        row["scenario"] = scenarios.get(row["session_id"])
+    return {"results": rows[:page_size], "page": page, "has_more": len(rows) > page_size}
+
+def search_history(user_id: int, query: str, page: int = 1, page_size: int = 20):
+    return run_in_session(get_read_session(("user", user_id)), _search_history, user_id, query, page, page_size)
+
+def _record_llm_usage(db, user_id: int, session_id: int, call_type: str, model: str,
+                     prompt_tokens: int, completion_tokens: int):
+    total_tokens = prompt_tokens + completion_tokens
+    today = date.today()
+    rollup_values = {
+        UserUsageDaily.requests: UserUsageDaily.requests + 1,
+        UserUsageDaily.prompt_tokens: UserUsageDaily.prompt_tokens + prompt_tokens,
+        UserUsageDaily.completion_tokens: UserUsageDaily.completion_tokens + completion_tokens,
+        UserUsageDaily.total_tokens: UserUsageDaily.total_tokens + total_tokens
+    }
+    rollup_filter = (UserUsageDaily.user_id == user_id, UserUsageDaily.day == today,
+                     UserUsageDaily.call_type == call_type)
+    db.add(LLMUsage(user_id=user_id, session_id=session_id, call_type=call_type, model=model,
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                    total_tokens=total_tokens, created_at=datetime.utcnow()))
+    updated = db.query(UserUsageDaily).filter(*rollup_filter).update(rollup_values, synchronize_session=False)
+    if not updated:
+        db.add(UserUsageDaily(user_id=user_id, day=today, call_type=call_type, requests=1,
+                              prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                              total_tokens=total_tokens))
     try:
-        session = db.query(Session).filter(Session.id == session_id).first()
-        if session:
-            db.delete(session)
-            db.commit()
-            return True
-        return False
-    finally:
-        db.close()
\ No newline at end of file
+        db.commit()
+    except IntegrityError:
+        # Another request created today's rollup row first
+        db.rollback()
+        db.add(LLMUsage(user_id=user_id, session_id=session_id, call_type=call_type, model=model,
+                        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                        total_tokens=total_tokens, created_at=datetime.utcnow()))
+        db.query(UserUsageDaily).filter(*rollup_filter).update(rollup_values, synchronize_session=False)
+        db.commit()
+    mark_write(("user", user_id))
+
+def record_llm_usage(user_id: int, session_id: int, call_type: str, model: str,
+                     prompt_tokens: int, completion_tokens: int):
+    return run_in_session(
+        SessionLocal(), _record_llm_usage,
+        user_id, session_id, call_type, model, prompt_tokens, completion_tokens
+    )
+
+def _get_daily_tokens(db, user_id: int, day: date):
+    total = (db.query(func.sum(UserUsageDaily.total_tokens))
+             .filter(UserUsageDaily.user_id == user_id, UserUsageDaily.day == day)
+             .scalar())
+    return total or 0
+
+def get_daily_tokens(user_id: int, day: date):
+    return run_in_session(get_read_session(("user", user_id)), _get_daily_tokens, user_id, day)
+
+def _get_user_usage(db, user_id: int, days: int = 30):
+    rows = (db.query(UserUsageDaily)
+            .filter(UserUsageDaily.user_id == user_id,
+                    UserUsageDaily.day >= date.today() - timedelta(days=days - 1))
+            .order_by(UserUsageDaily.day, UserUsageDaily.call_type)
+            .all())
+    by_call_type = {}
+    for row in rows:
+        totals = by_call_type.setdefault(row.call_type, {"requests": 0, "total_tokens": 0})
+        totals["requests"] += row.requests
+        totals["total_tokens"] += row.total_tokens
+    return {
+        "daily": [
+            {"day": row.day.isoformat(), "call_type": row.call_type, "requests": row.requests,
+             "prompt_tokens": row.prompt_tokens, "completion_tokens": row.completion_tokens,
+             "total_tokens": row.total_tokens}
+            for row in rows
+        ],
+        "by_call_type": by_call_type,
+        "total_tokens": sum(t["total_tokens"] for t in by_call_type.values())
+    }
+
+def get_user_usage(user_id: int, days: int = 30):
+    return run_in_session(get_read_session(("user", user_id)), _get_user_usage, user_id, days)
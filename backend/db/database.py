@@ -1,7 +1,10 @@
+import threading
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+from config import DATABASE_URL, READ_DATABASE_URL, REPLICA_LAG_SECONDS
 
 # Fallback to SQLite if DATABASE_URL is not set or is for Postgres but we want local dev
 if not DATABASE_URL:
@@ -14,10 +17,60 @@ engine = create_engine(
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Read-only queries go to the replica when one is configured
+if READ_DATABASE_URL:
+    read_engine = create_engine(
+        READ_DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in READ_DATABASE_URL else {}
+    )
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+else:
+    read_engine = engine
+    ReadSessionLocal = SessionLocal
+
+MAX_TRACKED_WRITES = 10000
+recent_writes = {}
+recent_writes_lock = threading.Lock()
+
+def mark_write(*keys):
+    # Keys such as ("session", 12) or ("user", 3) that were just written on the primary
+    if ReadSessionLocal is SessionLocal:
+        return
+    now = time.monotonic()
+    with recent_writes_lock:
+        for key in keys:
+            recent_writes[key] = now
+        if len(recent_writes) > MAX_TRACKED_WRITES:
+            for key, written_at in list(recent_writes.items()):
+                if now - written_at > REPLICA_LAG_SECONDS:
+                    del recent_writes[key]
+
+def recently_written(*keys):
+    now = time.monotonic()
+    with recent_writes_lock:
+        return any(now - recent_writes.get(key, float("-inf")) < REPLICA_LAG_SECONDS for key in keys)
+
+def get_read_session(*keys):
+    # Reads of anything written within the replica lag window stay on the primary
+    if ReadSessionLocal is SessionLocal or recently_written(*keys):
+        return SessionLocal()
+    return ReadSessionLocal()
+
+def run_in_session(db, fn, *args):
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
 Base = declarative_base()
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    from db.search import init_search_index
+    init_search_index(engine)
 
 def get_db():
     db = SessionLocal()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Date, DateTime, Boolean, JSON, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from db.database import Base
@@ -47,3 +47,66 @@ class Message(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     session = relationship("Session", back_populates="messages")
+
+    # Cursor reads scan (session_id, id) ranges instead of the whole table
+    __table_args__ = (Index("ix_messages_session_id_id", "session_id", "id"),)
+
+class UserStats(Base):
+    __tablename__ = "user_stats"
+
+    # Maintained incrementally by db.crud; rebuild with `python -m db.backfill_stats`
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    session_count = Column(Integer, default=0)
+    completed_sessions = Column(Integer, default=0)
+    message_count = Column(Integer, default=0)
+    scored_count = Column(Integer, default=0)
+    score_sum = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class SessionStats(Base):
+    __tablename__ = "session_stats"
+
+    session_id = Column(Integer, ForeignKey("sessions.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    scenario = Column(Text)
+    created_at = Column(DateTime)
+    completed = Column(Boolean, default=False)
+    message_count = Column(Integer, default=0)
+    scored_count = Column(Integer, default=0)
+    score_sum = Column(Integer, default=0)
+    last_score = Column(Integer, nullable=True)
+
+class LLMUsage(Base):
+    __tablename__ = "llm_usage"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    session_id = Column(Integer, nullable=True, index=True)
+    call_type = Column(String)
+    model = Column(String)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    total_tokens = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UserUsageDaily(Base):
+    __tablename__ = "user_usage_daily"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    call_type = Column(String, primary_key=True)
+    requests = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    total_tokens = Column(Integer, default=0)
+
+class SessionArchive(Base):
+    __tablename__ = "session_archives"
+
+    # zlib-compressed JSON of an ended session's messages, written by `python -m db.archive`
+    session_id = Column(Integer, ForeignKey("sessions.id"), primary_key=True)
+    payload = Column(LargeBinary)
+    message_count = Column(Integer)
+    raw_bytes = Column(Integer)
+    compressed_bytes = Column(Integer)
+    archived_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,132 @@
+"""
+Full-text index over message content and session scenarios/summaries.
+
+SQLite uses an FTS5 virtual table; Postgres uses a table with a generated
+tsvector column behind a GIN index. Rows are written by db.crud inside the
+same transaction as the data they mirror. Rebuild with `python -m db.search`.
+"""
+from sqlalchemy import text
+
+SQLITE_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_documents USING fts5(
+        body, kind UNINDEXED, user_id UNINDEXED, session_id UNINDEXED, message_id UNINDEXED,
+        tokenize='porter unicode61'
+    )"""
+]
+
+POSTGRES_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS search_documents (
+        id BIGSERIAL PRIMARY KEY,
+        body TEXT,
+        kind VARCHAR(16),
+        user_id INTEGER,
+        session_id INTEGER,
+        message_id INTEGER,
+        body_tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', coalesce(body, ''))) STORED
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_search_documents_body_tsv ON search_documents USING GIN (body_tsv)",
+    "CREATE INDEX IF NOT EXISTS ix_search_documents_user_id ON search_documents (user_id)",
+    "CREATE INDEX IF NOT EXISTS ix_search_documents_session_id ON search_documents (session_id)",
+]
+
+SQLITE_QUERY = """
+    SELECT kind, session_id, message_id,
+           snippet(search_documents, 0, '<mark>', '</mark>', '...', 16) AS highlight,
+           bm25(search_documents) AS rank
+    FROM search_documents
+    WHERE search_documents MATCH :query AND user_id = :user_id
+    ORDER BY rank
+    LIMIT :limit OFFSET :offset
+"""
+
+POSTGRES_QUERY = """
+    SELECT kind, session_id, message_id,
+           ts_headline('english', body, q, 'StartSel=<mark>, StopSel=</mark>, MaxFragments=1, MaxWords=24') AS highlight,
+           ts_rank(body_tsv, q) AS rank
+    FROM search_documents, websearch_to_tsquery('english', :query) AS q
+    WHERE body_tsv @@ q AND user_id = :user_id
+    ORDER BY rank DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+def _dialect(bind):
+    return bind.dialect.name
+
+def init_search_index(engine):
+    schema = {"sqlite": SQLITE_SCHEMA, "postgresql": POSTGRES_SCHEMA}.get(_dialect(engine))
+    if not schema:
+        return
+    with engine.begin() as conn:
+        for statement in schema:
+            conn.execute(text(statement))
+
+def index_document(db, kind: str, user_id: int, session_id: int, body: str, message_id: int = None):
+    if not body or _dialect(db.get_bind()) not in ("sqlite", "postgresql"):
+        return
+    db.execute(
+        text("INSERT INTO search_documents (body, kind, user_id, session_id, message_id) "
+             "VALUES (:body, :kind, :user_id, :session_id, :message_id)"),
+        {"body": body, "kind": kind, "user_id": user_id, "session_id": session_id, "message_id": message_id}
+    )
+
+def remove_documents(db, session_id: int, kind: str = None):
+    if _dialect(db.get_bind()) not in ("sqlite", "postgresql"):
+        return
+    statement = "DELETE FROM search_documents WHERE session_id = :session_id"
+    params = {"session_id": session_id}
+    if kind:
+        statement += " AND kind = :kind"
+        params["kind"] = kind
+    db.execute(text(statement), params)
+
+def _fts5_query(query: str):
+    # Quote every term so user input can't inject FTS5 operators
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+def search_documents(db, user_id: int, query: str, limit: int, offset: int):
+    dialect = _dialect(db.get_bind())
+    if dialect == "sqlite":
+        statement, query = SQLITE_QUERY, _fts5_query(query)
+    elif dialect == "postgresql":
+        statement = POSTGRES_QUERY
+    else:
+        return []
+    if not query.strip():
+        return []
+    rows = db.execute(
+        text(statement),
+        {"query": query, "user_id": user_id, "limit": limit, "offset": offset}
+    ).fetchall()
+    return [
+        {"kind": row.kind, "session_id": int(row.session_id),
+         "message_id": int(row.message_id) if row.message_id is not None else None,
+         "highlight": row.highlight, "rank": float(row.rank)}
+        for row in rows
+    ]
+
+def rebuild_search_index():
+    from db.database import SessionLocal, engine
+    from db.models import Session, Message, SessionArchive
+    from db.archive import unpack_messages
+
+    init_search_index(engine)
+    db = SessionLocal()
+    try:
+        db.execute(text("DELETE FROM search_documents"))
+        count = 0
+        for session in db.query(Session).all():
+            index_document(db, "scenario", session.user_id, session.id, session.scenario)
+            index_document(db, "summary", session.user_id, session.id, session.summary)
+            archive = db.get(SessionArchive, session.id)
+            for message in unpack_messages(archive.payload) if archive else []:
+                index_document(db, "message", session.user_id, session.id, message["content"], message["id"])
+            for message in db.query(Message).filter(Message.session_id == session.id).order_by(Message.id):
+                index_document(db, "message", session.user_id, session.id, message.content, message.id)
+            count += 1
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    print(f"Indexed {rebuild_search_index()} sessions")
@@ -4,6 +4,7 @@ from auth.routes import router as auth_router
 from chat.routes import router as chat_router
 from whop_auth import router as whop_router
 from db.database import init_db
+from admission import AdmissionControlMiddleware, admission_stats
 
 app = FastAPI(title="Perspectiq", version="1.0.0")
 
@@ -17,6 +18,9 @@ origins = [
     "https://whop.com",
 ]
 
+# Added before CORS so shed responses still carry CORS headers
+app.add_middleware(AdmissionControlMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -33,10 +37,15 @@ app.include_router(auth_router)
 app.include_router(chat_router)
 app.include_router(whop_router)
 
+# Probe endpoints are async so they don't wait on a threadpool full of LLM calls
 @app.get("/")
-def root():
+async def root():
     return {"message": "Perspectiq API", "status": "running"}
 
 @app.get("/health")
-def health():
-    return {"status": "healthy"}
\ No newline at end of file
+async def health():
+    return {"status": "healthy"}
+
+@app.get("/admission_stats")
+async def get_admission_stats():
+    return admission_stats()
@@ -0,0 +1,14 @@
+import asyncio
+from admission import RouteClassLimiter
+
+def test_burst_beyond_queue_is_shed_immediately():
+    async def burst():
+        limiter = RouteClassLimiter(concurrency=2, queue_size=2, queue_timeout=0.1)
+        results = await asyncio.gather(*(limiter.acquire() for _ in range(20)))
+        return limiter, results
+
+    limiter, results = asyncio.run(burst())
+    # 2 admitted, 2 queued until the timeout, the other 16 turned away on arrival
+    assert results.count(True) == 2
+    assert limiter.timed_out == 2
+    assert limiter.shed - limiter.timed_out == 16
@@ -30,10 +30,23 @@ const ChatInterface: React.FC = () => {
 
   const loadMessages = async () => {
     try {
-      const res = await api.chat.getMessages(Number(sessionId));
+      let res = await api.chat.getMessages(Number(sessionId));
       setMessages(res.messages);
+      // The opening message is generated in the background after /chat/start returns;
+      // each poll only asks for messages after the last one already shown
+      while (res.pending) {
+        setIsLoading(true);
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        res = await api.chat.getMessages(Number(sessionId), res.last_id);
+        const newMessages = res.messages;
+        if (newMessages.length > 0) {
+          setMessages(prev => [...prev, ...newMessages]);
+        }
+      }
     } catch (err) {
       console.error("Failed to load history", err);
+    } finally {
+      setIsLoading(false);
     }
   };
 
@@ -53,27 +66,12 @@ const ChatInterface: React.FC = () => {
     try {
       const res = await api.chat.sendMessage({
         session_id: Number(sessionId),
-        message: userMsg.content
+        message: userMsg.content,
+        defer_feedback: true
       });
 
       if (res.feedback) {
-        setMessages(prev => {
-          const newMessages = [...prev];
-          let lastUserIndex = -1;
-          for (let i = newMessages.length - 1; i >= 0; i--) {
-            if (newMessages[i].role === 'user') {
-              lastUserIndex = i;
-              break;
-            }
-          }
-          if (lastUserIndex !== -1) {
-            newMessages[lastUserIndex] = {
-              ...newMessages[lastUserIndex],
-              feedback: res.feedback
-            };
-          }
-          return newMessages;
-        });
+        attachFeedback(userMsg, res.feedback);
       }
 
       const botMsg: Message = {
@@ -82,6 +80,11 @@ const ChatInterface: React.FC = () => {
         persona: res.persona
       };
       setMessages(prev => [...prev, botMsg]);
+
+      // The reply is shown first; the coach's tip arrives once it has been scored
+      if (res.feedback_pending && res.message_id) {
+        pollFeedback(userMsg, res.message_id);
+      }
     } catch (err) {
       console.error("Send failed", err);
     } finally {
@@ -89,6 +92,26 @@ const ChatInterface: React.FC = () => {
     }
   };
 
+  const attachFeedback = (target: Message, feedback: Message['feedback']) => {
+    setMessages(prev => prev.map(m => m === target ? { ...m, feedback } : m));
+  };
+
+  const pollFeedback = async (target: Message, messageId: number) => {
+    try {
+      for (let attempt = 0; attempt < 30; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const res = await api.chat.getFeedback(messageId);
+        if (res.feedback) {
+          attachFeedback(target, res.feedback);
+          return;
+        }
+        if (!res.pending) return;
+      }
+    } catch (err) {
+      console.error("Failed to load feedback", err);
+    }
+  };
+
   const handleKeyDown = (e: React.KeyboardEvent) => {
     if (e.key === 'Enter' && !e.shiftKey) {
       e.preventDefault();
@@ -9,6 +9,7 @@ import {
   SendMessageRequest,
   SendMessageResponse,
   GetMessagesResponse,
+  GetFeedbackResponse,
   EndSessionRequest,
   EndSessionResponse,
   GetHistoryResponse,
@@ -87,7 +88,10 @@ export const api = {
       method: 'POST',
       body: JSON.stringify(data),
     }),
-    getMessages: (sessionId: number) => request<GetMessagesResponse>(`/chat/messages/${sessionId}`),
+    getMessages: (sessionId: number, sinceId?: number) => request<GetMessagesResponse>(
+      `/chat/messages/${sessionId}${sinceId != null ? `?since_id=${sinceId}` : ''}`
+    ),
+    getFeedback: (messageId: number) => request<GetFeedbackResponse>(`/chat/feedback/${messageId}`),
     endSession: (data: EndSessionRequest) => request<EndSessionResponse>('/chat/end', {
       method: 'POST',
       body: JSON.stringify(data),
@@ -39,11 +39,14 @@ export interface StartSessionRequest {
 
 export interface StartSessionResponse {
   session_id: number;
+  opener?: { persona: string; message: string } | null;
+  opener_pending?: boolean;
 }
 
 export interface SendMessageRequest {
   session_id: number;
   message: string;
+  defer_feedback?: boolean;
 }
 
 export interface SendMessageResponse {
@@ -54,6 +57,14 @@ export interface SendMessageResponse {
     feedback: string;
     suggested_response?: string;
   };
+  message_id?: number;
+  feedback_pending?: boolean;
+}
+
+export interface GetFeedbackResponse {
+  message_id: number;
+  feedback?: SendMessageResponse['feedback'] | null;
+  pending: boolean;
 }
 
 export interface Message {
@@ -69,6 +80,8 @@ export interface Message {
 
 export interface GetMessagesResponse {
   messages: Message[];
+  last_id?: number | null;
+  pending?: boolean;
 }
 
 export interface EndSessionRequest {